@@ -0,0 +1,98 @@
+#! /usr/bin/env python
+
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Per-call cost of the with_livelocals decorator
+
+Times a small function which reads and assigns one of its own
+variables, first directly, then through `livelocals()`, and then
+through the handle given by `@with_livelocals`. Reports the time per
+call of each, and the overhead of each over the plain function.
+
+usage: python benchmarks/decorator.py [--calls N] [--repeat N]
+
+author: Christopher O'Brien  <obriencj@gmail.com>
+license: LGPL v.3
+"""
+
+
+from __future__ import print_function
+
+import sys
+
+from argparse import ArgumentParser
+from timeit import repeat
+
+from livelocals import livelocals, with_livelocals
+
+
+def plain(a=1, b=2):
+    a = b + 1
+    return a
+
+
+def called(a=1, b=2):
+    ll = livelocals()
+    ll["a"] = ll["b"] + 1
+    return a
+
+
+@with_livelocals
+def decorated(a=1, b=2, ll=None):
+    ll["a"] = ll["b"] + 1
+    return a
+
+
+CASES = (
+    ("plain", plain),
+    ("livelocals()", called),
+    ("@with_livelocals", decorated),
+)
+
+
+def main(args=None):
+    parser = ArgumentParser(description="with_livelocals per-call cost")
+    parser.add_argument("--calls", type=int, default=200000,
+                        help="calls per measurement")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="measurements per case, the best is kept")
+    options = parser.parse_args(args)
+
+    calls = options.calls
+
+    print("Python %s" % sys.version.split()[0])
+    print("%18s %12s %12s" % ("case", "ns/call", "overhead"))
+
+    base = None
+    for label, func in CASES:
+        best = min(repeat(func, number=calls, repeat=options.repeat))
+        per_call = best * 1e9 / calls
+
+        if base is None:
+            base = per_call
+
+        print("%18s %12.0f %12.0f" % (label, per_call, per_call - base))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+#
+# The end.
@@ -0,0 +1,270 @@
+#! /usr/bin/env python
+
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Soak test for leaks and throughput drift in livelocals
+
+Repeatedly creates, uses, and discards livelocals, generatorlocals,
+and localvar views over fast, cell, and free variables, along with the
+other native accessors. After each batch of iterations it samples the
+process RSS, the number of objects tracked by gc, the number of live
+views in the livelocals cache, the total reference count (on debug
+builds of Python only), and the operations per second.
+
+The first batches are treated as warm-up. The run fails, with an exit
+status of 1, if any measure grows beyond its threshold between the
+end of the warm-up and the end of the run, or if the throughput of the
+last batches falls too far below that of the first. The throughput is
+only compared when there are enough samples after the warm-up to
+average several batches at each end.
+
+usage: python benchmarks/soak.py [--iterations N] [--samples N]
+
+author: Christopher O'Brien  <obriencj@gmail.com>
+license: LGPL v.3
+"""
+
+
+from __future__ import print_function
+
+import gc
+import os
+import sys
+
+from argparse import ArgumentParser
+from time import time
+
+import livelocals as _livelocals
+
+from livelocals import livelocals, generatorlocals, localvar, \
+    namespace, snapshot_record
+
+
+# The fewest samples averaged at each end of the run before their
+# throughput is compared. A single batch is too noisy to judge by.
+_MIN_WINDOW = 3
+
+
+def _rss_kb():
+    """
+    Current resident set size of this process in KiB, or the peak RSS
+    where the current size isn't available, or None.
+    """
+
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _total_refcount():
+    counter = getattr(sys, "gettotalrefcount", None)
+    return counter() if counter else None
+
+
+def _counting(total=0):
+    while True:
+        step = yield total
+        total += step
+
+
+def exercise():
+    """
+    One iteration of the workload. Returns the number of operations
+    performed.
+    """
+
+    ops = 0
+    fast = [1]
+    cell = {"key": "value"}
+    gone = None
+    del gone
+
+    def closure():
+        temp = cell
+        found = livelocals()
+        found["cell"] = found["cell"]
+        found["temp"] = None
+        del found["temp"]
+        found.clear()
+        return cell
+
+    ll = livelocals()
+    ll["fast"] = list(ll["fast"])
+    ll["cell"] = dict(ll["cell"])
+    ll.get("gone")
+    ll.setdefault("gone", 0)
+    del ll["gone"]
+    ops += 7
+
+    with ll.transaction() as tx:
+        tx["fast"] = [2]
+        tx["cell"] = {"key": "other"}
+    ops += 1
+
+    closure()
+    ops += 4
+
+    for name in ("fast", "cell"):
+        var = localvar(name)
+        var.setvar(var.getvar())
+        ops += 3
+
+    ns = namespace()
+    ns.fast = ns.cell
+    del ns
+    ops += 3
+
+    snapshot_record()
+    ops += 1
+
+    ll.clear()
+
+    gen = _counting()
+    next(gen)
+    gl = generatorlocals(gen)
+    gl["total"] = gl["total"] + 1
+    gen.send(1)
+    gen.close()
+    ops += 3
+
+    return ops
+
+
+def sample(iterations):
+    """
+    Runs a batch of iterations, then collects garbage and returns a
+    dict of measurements.
+    """
+
+    ops = 0
+    start = time()
+    for _i in range(iterations):
+        ops += exercise()
+    elapsed = time() - start
+
+    gc.collect()
+
+    return {
+        "rate": ops / elapsed if elapsed else 0.0,
+        "rss": _rss_kb(),
+        "objects": len(gc.get_objects()),
+        "cache": len(_livelocals._cache),
+        "refs": _total_refcount(),
+    }
+
+
+def _fmt(value):
+    return "-" if value is None else "%i" % value
+
+
+def main(args=None):
+    parser = ArgumentParser(description="livelocals soak test")
+    parser.add_argument("--iterations", type=int, default=1000000,
+                        help="total iterations of the workload")
+    parser.add_argument("--samples", type=int, default=20,
+                        help="number of measurements over the run")
+    parser.add_argument("--warmup", type=int, default=2,
+                        help="samples to discard before the baseline")
+    parser.add_argument("--max-rss-growth", type=int, default=8192,
+                        help="allowed RSS growth in KiB")
+    parser.add_argument("--max-object-growth", type=int, default=1000,
+                        help="allowed growth in gc tracked objects")
+    parser.add_argument("--max-cache-growth", type=int, default=0,
+                        help="allowed growth in cached livelocals views")
+    parser.add_argument("--max-refcount-growth", type=int, default=10000,
+                        help="allowed growth in total refcount")
+    parser.add_argument("--max-slowdown", type=float, default=0.25,
+                        help="allowed fractional drop in ops/sec")
+    options = parser.parse_args(args)
+
+    samples = max(options.samples, options.warmup + 2)
+    per_sample = max(1, options.iterations // samples)
+
+    print("Python %s, %i samples of %i iterations" %
+          (sys.version.split()[0], samples, per_sample))
+    print("%6s %12s %10s %10s %6s %12s" %
+          ("sample", "ops/sec", "rss KiB", "objects", "cache", "refcount"))
+
+    found = []
+    for index in range(samples):
+        measured = sample(per_sample)
+        found.append(measured)
+
+        print("%6i %12.0f %10s %10s %6s %12s%s" %
+              (index, measured["rate"], _fmt(measured["rss"]),
+               _fmt(measured["objects"]), _fmt(measured["cache"]),
+               _fmt(measured["refs"]),
+               "  (warm-up)" if index < options.warmup else ""))
+
+    measured = found[options.warmup:]
+    first, last = measured[0], measured[-1]
+
+    failures = []
+
+    limits = (("rss", options.max_rss_growth),
+              ("objects", options.max_object_growth),
+              ("cache", options.max_cache_growth),
+              ("refs", options.max_refcount_growth))
+
+    for key, limit in limits:
+        if first[key] is None or last[key] is None:
+            continue
+
+        growth = last[key] - first[key]
+        if growth > limit:
+            failures.append("%s grew by %i (limit %i)" %
+                            (key, growth, limit))
+
+    window = len(measured) // 4
+    if window < _MIN_WINDOW:
+        print("too few samples to compare ops/sec, need %i after warm-up" %
+              (_MIN_WINDOW * 4))
+
+    else:
+        before = sum(m["rate"] for m in measured[:window]) / window
+        after = sum(m["rate"] for m in measured[-window:]) / window
+
+        if before and (before - after) / before > options.max_slowdown:
+            failures.append("ops/sec fell from %.0f to %.0f (limit %i%%)" %
+                            (before, after, options.max_slowdown * 100))
+
+    if failures:
+        for failure in failures:
+            print("FAIL:", failure)
+        return 1
+
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+#
+# The end.
@@ -0,0 +1,124 @@
+#! /usr/bin/env python
+
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+Thread scaling benchmark for livelocals
+
+Runs N threads, each repeatedly calling a function which inspects and
+alters its own frame through livelocals, namespace, getvar, and
+setvar. Reports throughput and the speedup over a single thread for
+each thread count. On a free-threaded build of Python, the speedup
+should be close to linear. With the GIL it will stay near 1.
+
+usage: python benchmarks/threads.py [--threads 1,2,4,8] [--iterations N]
+
+author: Christopher O'Brien  <obriencj@gmail.com>
+license: LGPL v.3
+"""
+
+
+from __future__ import print_function
+
+import sys
+
+from argparse import ArgumentParser
+from threading import Barrier, Thread
+from time import time
+
+from livelocals import livelocals, namespace, getvar, setvar, _gil_disabled
+
+
+def inspected(a=1, b=2):
+    def inner():
+        return b
+
+    with livelocals() as ll:
+        ll["a"] = ll["b"] + 1
+
+    ns = namespace()
+    ns.a += 1
+    del ns
+
+    setvar("b", getvar("a"))
+    return inner()
+
+
+def worker(iterations, barrier):
+    barrier.wait()
+    for _i in range(iterations):
+        inspected()
+
+
+def measure(threads, iterations):
+    """
+    Returns the seconds taken for the given number of threads to each
+    complete the given number of iterations.
+    """
+
+    barrier = Barrier(threads + 1)
+    workers = [Thread(target=worker, args=(iterations, barrier))
+               for _i in range(threads)]
+
+    for w in workers:
+        w.start()
+
+    barrier.wait()
+    start = time()
+
+    for w in workers:
+        w.join()
+
+    return time() - start
+
+
+def main(args=None):
+    parser = ArgumentParser(description="livelocals thread scaling")
+    parser.add_argument("--threads", default="1,2,4,8",
+                        help="comma-separated thread counts")
+    parser.add_argument("--iterations", type=int, default=20000,
+                        help="calls per thread")
+    options = parser.parse_args(args)
+
+    counts = [int(c) for c in options.threads.split(",")]
+    iterations = options.iterations
+
+    gil = "disabled" if _gil_disabled() else "enabled"
+    print("Python %s, GIL %s" % (sys.version.split()[0], gil))
+    print("%8s %14s %10s %12s" % ("threads", "calls/sec", "speedup",
+                                  "efficiency"))
+
+    base = None
+    for count in counts:
+        elapsed = measure(count, iterations)
+        rate = (count * iterations) / elapsed
+
+        if base is None:
+            base = rate / count
+
+        speedup = rate / base
+        print("%8i %14.0f %9.2fx %11.0f%%" %
+              (count, rate, speedup, 100.0 * speedup / count))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+#
+# The end.
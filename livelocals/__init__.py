@@ -23,19 +23,34 @@ license: LGPL v.3
 """
 
 
-from collections import namedtuple
-from functools import partial
-from inspect import currentframe
+from collections import OrderedDict, namedtuple
+from functools import partial, wraps
+from inspect import CO_OPTIMIZED, currentframe
+from operator import itemgetter
 from sys import version_info
-from weakref import WeakValueDictionary
+from threading import Lock
+from types import FunctionType
+from weakref import WeakKeyDictionary, WeakValueDictionary
+
+import inspect
+import sys
 
 from livelocals._frame import \
     frame_get_fast, frame_set_fast, frame_del_fast, \
-    frame_get_cell, frame_set_cell, frame_del_cell
+    frame_get_cell, frame_set_cell, frame_del_cell, \
+    frame_get_locals, frame_values, frame_apply, \
+    closure_get, closure_set, closure_del, closure_rebind, \
+    FrameNamespace, slotvar, set_hooks, stats, reset_stats
+from livelocals.liveness import live_names
 
 
-__all__ = ("LiveLocals", "livelocals", "generatorlocals",
-           "LocalVar", "localvar", "getvar", "setvar", "delvar", )
+__all__ = ("LiveLocals", "LiveDictLocals", "livelocals", "generatorlocals",
+           "ClosureLocals", "closurelocals", "rebind_closures",
+           "Transaction", "LocalsHandle", "with_livelocals",
+           "LocalVar", "localvar", "getvar", "setvar", "delvar",
+           "evaluate", "snapshot", "namespace", "lookup_dynamic",
+           "LocalsRecord", "record_type", "snapshot_record", "UNBOUND",
+           "set_hooks", "stats", "reset_stats", )
 
 
 class RaiseError(object):
@@ -50,6 +65,28 @@ _raise_error = RaiseError()
 del RaiseError
 
 
+# sentinel passed as the default to the frame getters, so that an
+# unbound variable can be told apart from one bound to None
+_unbound = object()
+
+
+class Unbound(object):
+    __slots__ = ()
+
+    def __repr__(self):
+        return "<unbound>"
+
+    def __reduce__(self):
+        return "UNBOUND"
+
+
+# marks an unbound variable in the records from snapshot_record
+UNBOUND = Unbound()
+
+
+del Unbound
+
+
 # simple way to hold the getter, setter, and clear functions for each
 # var in a frame.
 LocalVar = namedtuple("LocalVar", ("getvar", "setvar", "delvar",
@@ -81,6 +118,48 @@ def _local_cell(frame, index, name):
                     frame, name)
 
 
+def _dict_get(mapping, name, default=_raise_error):
+    try:
+        return mapping[name]
+    except KeyError:
+        if default is _raise_error:
+            raise NameError("name %r is not defined" % name)
+        return default
+
+
+def _dict_del(mapping, name):
+    try:
+        del mapping[name]
+    except KeyError:
+        pass
+
+
+def _local_dict(frame, mapping, name):
+    """
+    Create an object with three functions for getting, setting, and
+    clearing a var held in the locals mapping of a module or class body
+    frame.
+    """
+
+    return LocalVar(partial(_dict_get, mapping, name),
+                    partial(mapping.__setitem__, name),
+                    partial(_dict_del, mapping, name),
+                    frame, name)
+
+
+def _frame_dict(frame):
+    """
+    Returns the mapping which holds the variables of a module or class
+    body frame, or None if the frame's code is optimized to use fast
+    variables instead.
+    """
+
+    if frame.f_code.co_flags & CO_OPTIMIZED:
+        return None
+    else:
+        return frame_get_locals(frame)
+
+
 def localvar(name, frame=None):
     """
     Returns a LocalVar namedtuple instance with accessors for getting,
@@ -108,6 +187,10 @@ def localvar(name, frame=None):
         if n == name:
             return _local_cell(frame, i, n)
 
+    mapping = _frame_dict(frame)
+    if mapping is not None and name in mapping:
+        return _local_dict(frame, mapping, name)
+
     return None
 
 
@@ -183,7 +266,7 @@ class LiveLocals(object):
     any references the frame may have to the instance as well.
     """
 
-    __slots__ = ("_frame_id", "_vars", "__weakref__", )
+    __slots__ = ("_frame_id", "_frame", "_vars", "_ns", "__weakref__", )
 
 
     def __init__(self, frame):
@@ -192,6 +275,8 @@ class LiveLocals(object):
         """
 
         self._frame_id = id(frame)
+        self._frame = frame
+        self._ns = None
         self._vars = vars = {}
 
         code = frame.f_code
@@ -385,6 +470,34 @@ class LiveLocals(object):
             return default
 
 
+    @property
+    def ns(self):
+        """
+        An attribute-style namespace for the same frame, as returned by
+        `namespace()`.
+        """
+
+        found = self._ns
+        if found is None:
+            if self._frame is None:
+                raise ValueError("%r has been cleared" % self)
+            found = self._ns = namespace(self._frame)
+        return found
+
+
+    def transaction(self):
+        """
+        Returns a Transaction which buffers writes to the variables of
+        the same frame, and applies them all at once. Used as a context
+        manager, the writes are applied when the block exits normally,
+        and discarded if it raises.
+        """
+
+        if self._frame is None:
+            raise ValueError("%r has been cleared" % self)
+        return Transaction(self._frame)
+
+
     def localvar(self, key):
         """
         Returns the underlying LocalVar namedtuple for the given key, or
@@ -448,36 +561,347 @@ class LiveLocals(object):
         variable.
         """
 
+        ns = self._ns
+
         for key, val in self.items():
-            if val is self:
+            if val is self or (val is ns and ns is not None):
                 self._vars[key].delvar()
-                break
 
         self._vars.clear()
+        self._frame = None
+        self._ns = None
+
+
+class LiveDictLocals(LiveLocals):
+    """
+    Living view of the variables of a module or class body frame. These
+    frames hold their variables in a mapping rather than in fast
+    slots, so this view reads and writes that mapping directly, without
+    copying it. Any cell or free variables of the frame, such as the
+    `__class__` cell of a class body, are merged in and take precedence
+    over the mapping.
+
+    Unlike fast variables, a name which isn't present in the mapping
+    is simply undefined, so looking it up raises a KeyError, and
+    assigning to it will define it.
+    """
+
+    __slots__ = ("_dict", )
+
+
+    def __init__(self, frame, mapping=None):
+        """
+        Initializes a Live Locals view for a frame. If mapping is None,
+        the frame's own locals mapping is used.
+        """
+
+        LiveLocals.__init__(self, frame)
+
+        if mapping is None:
+            mapping = frame_get_locals(frame)
+        self._dict = mapping
+
+
+    def __getitem__(self, key):
+        var = self._vars.get(key, None)
+        if var is None:
+            return self._dict[key]
+        else:
+            return var.getvar()
+
+
+    def __setitem__(self, key, value):
+        var = self._vars.get(key, None)
+        if var is None:
+            self._dict[key] = value
+        else:
+            var.setvar(value)
+
+
+    def __delitem__(self, key):
+        var = self._vars.get(key, None)
+        if var is None:
+            del self._dict[key]
+        else:
+            var.delvar()
+
+
+    def __contains__(self, key):
+        return key in self._vars or key in self._dict
+
+
+    def _iteritems(self):
+        vars = self._vars
+
+        for key, value in self._dict.items():
+            if key not in vars:
+                yield (key, value)
+
+        for key, var in vars.items():
+            try:
+                yield (key, var.getvar())
+            except NameError:
+                pass
+
+
+    if (3, 0) <= version_info:
+        items = _iteritems
+    else:
+        iteritems = _iteritems
+
+
+    def get(self, key, default=None):
+        var = self._vars.get(key, None)
+        if var is None:
+            return self._dict.get(key, default)
+        else:
+            return var.getvar(default)
+
+
+    def localvar(self, key):
+        var = self._vars.get(key, None)
+        if var is None and key in self._dict:
+            var = _local_dict(self._frame, self._dict, key)
+        return var
+
+
+    def update(self, mapping, allow=None):
+        """
+        Updates matching scoped variables to the value from mapping, if
+        any. Keys from mapping which aren't a cell or free variable, and
+        which aren't already present in the frame's mapping, are
+        ignored.
+
+        allow filters the keys of mapping, as in `LiveLocals.update()`.
+        """
+
+        if allow is None:
+            source = mapping.items()
+
+        elif callable(allow):
+            source = ((key, value) for key, value in mapping.items()
+                      if allow(key))
+
+        else:
+            source = ((key, value) for key, value in mapping.items()
+                      if key in allow)
+
+        vars = self._vars
+        scope = self._dict
+
+        for key, val in source:
+            if key in vars:
+                vars[key].setvar(val)
+            elif key in scope:
+                scope[key] = val
+
+
+    def setdefault(self, key, default=None):
+        if key in self._vars:
+            return LiveLocals.setdefault(self, key, default)
+        else:
+            return self._dict.setdefault(key, default)
+
+
+    def clear(self):
+        """
+        Releases the references to the underlying frame and its mapping,
+        and removes any references in the frame to this livelocals by
+        clearing the variable.
+        """
+
+        scope = self._dict
+        ns = self._ns
+
+        found = [key for key, val in scope.items()
+                 if val is self or (val is ns and ns is not None)]
+        for key in found:
+            del scope[key]
+
+        self._dict = {}
+        LiveLocals.clear(self)
+
+
+class Transaction(object):
+    """
+    A batch of writes to the fast, cell, and free variables of a frame.
+    Assigning or deleting an item buffers the write, after checking
+    that the frame's code declares the variable. Reading an item sees
+    any buffered write, and otherwise the frame's current value.
+
+    `commit()` applies every buffered write in a single native call,
+    so that nothing else may run while only some of them have been
+    applied. If any write can't be applied, none are.
+    """
+
+    __slots__ = ("_frame", "_layout", "_writes", )
+
+
+    def __init__(self, frame):
+        self._frame = frame
+        self._layout = _layout(frame.f_code)
+        self._writes = {}
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, tb_type, _tb_value, _tb_traceback):
+        if tb_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+
+    def __repr__(self):
+        return "<transaction of %i writes for frame at 0x%08x>" % \
+            (len(self._writes), id(self._frame))
+
+
+    def __len__(self):
+        return len(self._writes)
+
+
+    def __getitem__(self, key):
+        """
+        Returns the buffered value for key if it has one, otherwise the
+        variable's current value. Raises a KeyError if the variable is
+        not declared, and a NameError if it is or will be undefined.
+        """
+
+        found = self._layout[key]
+        writes = self._writes
+
+        if key not in writes:
+            return found[1](self._frame, found[0])
+
+        value = writes[key]
+        if value is _unbound:
+            raise NameError("name %r is not defined" % key)
+        else:
+            return value
+
+
+    def __setitem__(self, key, value):
+        """
+        Buffers an assignment of value to the given declared variable.
+        Raises a KeyError if the variable is not declared.
+        """
+
+        self._layout[key]
+        self._writes[key] = value
+
+
+    def __delitem__(self, key):
+        """
+        Buffers the clearing of the given declared variable. Raises a
+        KeyError if the variable is not declared.
+        """
+
+        self._layout[key]
+        self._writes[key] = _unbound
+
+
+    def commit(self):
+        """
+        Applies all of the buffered writes to the frame at once, and
+        empties the buffer.
+        """
+
+        layout = self._layout
+        writes = tuple((layout[key][0], value)
+                       for key, value in self._writes.items())
+
+        self._writes.clear()
+        if writes:
+            frame_apply(self._frame, writes, _unbound)
+
+
+    def rollback(self):
+        """
+        Discards all of the buffered writes.
+        """
+
+        self._writes.clear()
+
+
+class _ShardedCache(object):
+    """
+    A WeakValueDictionary split into shards by frame, each guarded by
+    its own lock. Without the GIL, threads inspecting their own frames
+    then rarely contend on the same lock.
+    """
+
+    __slots__ = ("_shards", )
+
+
+    def __init__(self, count=64):
+        self._shards = tuple((Lock(), WeakValueDictionary())
+                             for _i in range(count))
+
+
+    def __len__(self):
+        return sum(len(shard) for _lock, shard in self._shards)
+
+
+    def _shard(self, frame):
+        shards = self._shards
+        return shards[hash(frame) % len(shards)]
+
+
+    def get(self, frame, default=None):
+        lock, shard = self._shard(frame)
+        with lock:
+            return shard.get(frame, default)
+
+
+    def __setitem__(self, frame, found):
+        lock, shard = self._shard(frame)
+        with lock:
+            shard[frame] = found
+
+
+def _gil_disabled():
+    """
+    True if this is a free-threaded build of Python running without
+    the GIL.
+    """
+
+    check = getattr(sys, "_is_gil_enabled", None)
+    return check is not None and not check()
 
 
 # This is our default cache. Frames can't be weakreferenced, so we
 # keep a weak ref to the LiveLocals instance instead.
-_cache = WeakValueDictionary()
+_cache = _ShardedCache() if _gil_disabled() else WeakValueDictionary()
 
 
 def livelocals(frame=None, _cache=_cache):
     """
     Given a Python frame, return a live view of its variables. If
     frame is unspecified or None, the calling frame is used.
+
+    Frames of module and class body code, which keep their variables
+    in a mapping, are given a LiveDictLocals view over that mapping.
     """
 
     if frame is None:
         frame = currentframe().f_back
 
-    if _cache is None:
-        found = LiveLocals(frame)
+    if _cache is not None:
+        found = _cache.get(frame, None)
+        if found is not None:
+            return found
 
+    mapping = _frame_dict(frame)
+    if mapping is None:
+        found = LiveLocals(frame)
     else:
-        found = _cache.get(frame, None)
-        if found is None:
-            found = LiveLocals(frame)
-            _cache[frame] = found
+        found = LiveDictLocals(frame, mapping)
+
+    if _cache is not None:
+        _cache[frame] = found
 
     return found
 
@@ -494,5 +918,688 @@ def generatorlocals(gen):
     return livelocals(gen.gi_frame)
 
 
+class ClosureLocals(LiveLocals):
+    """
+    Living view of the free variables of a function, read and written
+    through the cells of its closure. No frame is involved, so the
+    variables may be read or replaced whether or not the function is
+    running. The cells are shared with the scope which created the
+    function, and with any other closures created by the same call of
+    that scope.
+    """
+
+    __slots__ = ("_func", )
+
+
+    def __init__(self, func):
+        """
+        Initializes a Closure Locals view for a function.
+        """
+
+        if not isinstance(func, FunctionType):
+            raise TypeError("expected function, not %r" %
+                            type(func).__name__)
+
+        self._frame_id = id(func)
+        self._frame = None
+        self._ns = None
+        self._func = func
+        self._vars = vars = {}
+
+        for i, name in enumerate(func.__code__.co_freevars):
+            vars[name] = LocalVar(partial(closure_get, func, i),
+                                  partial(closure_set, func, i),
+                                  partial(closure_del, func, i),
+                                  None, name)
+
+
+    def __repr__(self):
+        return "<closurelocals for function at 0x%08x>" % self._frame_id
+
+
+    @property
+    def ns(self):
+        raise TypeError("%r has no frame for a namespace" % self)
+
+
+    def transaction(self):
+        raise TypeError("%r has no frame for a transaction" % self)
+
+
+    def clear(self):
+        """
+        Releases the references to the underlying function, and removes
+        any references its closure may have to this view by clearing
+        the variable.
+        """
+
+        LiveLocals.clear(self)
+        self._func = None
+
+
+def closurelocals(func):
+    """
+    Given a Python function, return a ClosureLocals view of its free
+    variables.
+    """
+
+    return ClosureLocals(func)
+
+
+def rebind_closures(funcs, name, value):
+    """
+    Assigns value to the free variable name of each function in funcs,
+    in a single native pass, and returns the number of functions.
+
+    Functions created from the same code object, such as the closures
+    returned by one factory, share the lookup of the variable's
+    index. If any of funcs isn't a function with a free variable of
+    that name, raises a TypeError or KeyError and changes nothing.
+
+    Note that closures created by the same call of their factory share
+    their cells, so rebinding one of them rebinds them all.
+    """
+
+    return closure_rebind(funcs, name, value)
+
+
+class LocalsHandle(object):
+    """
+    A lightweight view of the fast, cell, and free variables of a frame
+    running a particular code object, as passed to functions decorated
+    by `with_livelocals`.
+
+    The handle is created before its frame exists, so it binds when it
+    is first used. If created with the caller of that frame, it binds
+    to the frame on the calling stack running its code that was called
+    by caller, otherwise to the nearest frame running its code. The
+    decorator releases the frame when the call returns, after which any
+    use of the handle raises a RuntimeError.
+    """
+
+    __slots__ = ("_code", "_layout", "_frame", "_caller", "_released", )
+
+
+    def __init__(self, code, layout, frame=None, caller=None):
+        self._code = code
+        self._layout = layout
+        self._frame = frame
+        self._caller = caller
+        self._released = False
+
+
+    def __repr__(self):
+        return "<livelocals handle for %s>" % self._code.co_name
+
+
+    def _bind(self):
+        if self._released:
+            # another frame running the same code may be on the stack,
+            # but it isn't this handle's
+            raise RuntimeError("%r was released when its call returned" %
+                               self)
+
+        frame = sys._getframe(2)
+        code = self._code
+        caller = self._caller
+
+        # in a recursive call, the nearest frame running this code may
+        # belong to another handle
+        while frame is not None:
+            if frame.f_code is code:
+                if caller is None or frame.f_back is caller:
+                    break
+            frame = frame.f_back
+
+        if frame is None:
+            raise RuntimeError("%r is not bound to a running frame" % self)
+
+        self._frame = frame
+        return frame
+
+
+    @property
+    def frame(self):
+        """
+        The frame this handle reads and writes.
+        """
+
+        return self._frame or self._bind()
+
+
+    def __getitem__(self, key):
+        """
+        Returns the value of the given declared variable. Raises a
+        KeyError if it is not declared, or a NameError if it is not
+        currently defined.
+        """
+
+        index, getter, _setter, _deleter = self._layout[key]
+        return getter(self._frame or self._bind(), index)
+
+
+    def __setitem__(self, key, value):
+        """
+        Assigns value to the given declared variable. Raises a KeyError
+        if it is not declared.
+        """
+
+        index, _getter, setter, _deleter = self._layout[key]
+        setter(self._frame or self._bind(), index, value)
+
+
+    def __delitem__(self, key):
+        """
+        Clears the given declared variable. Raises a KeyError if it is
+        not declared.
+        """
+
+        index, _getter, _setter, deleter = self._layout[key]
+        deleter(self._frame or self._bind(), index)
+
+
+    def __contains__(self, key):
+        return key in self._layout
+
+
+    def get(self, key, default=None):
+        """
+        Returns the value of a variable if it is declared and assigned,
+        otherwise the given default value.
+        """
+
+        found = self._layout.get(key, None)
+        if found is None:
+            return default
+        return found[1](self._frame or self._bind(), found[0], default)
+
+
+    def livelocals(self):
+        """
+        Returns the full LiveLocals view of the same frame.
+        """
+
+        return livelocals(self._frame or self._bind())
+
+
+# code flags of functions which return a generator or coroutine,
+# whose frame may be suspended and resumed
+_SUSPENDS = 0
+for _flag in ("CO_GENERATOR", "CO_COROUTINE", "CO_ITERABLE_COROUTINE",
+              "CO_ASYNC_GENERATOR"):
+    _SUSPENDS |= getattr(inspect, _flag, 0)
+del _flag
+
+
+def _deferred_frame(result):
+    for attr in ("gi_frame", "cr_frame", "ag_frame"):
+        frame = getattr(result, attr, None)
+        if frame is not None:
+            return frame
+    return None
+
+
+def with_livelocals(func=None, name="ll"):
+    """
+    Decorator which passes a LocalsHandle for the function's own frame
+    as the keyword argument name. The function's variable layout is
+    computed once, when it is decorated, so each call costs only the
+    creation of the handle, rather than the frame lookup, cache check,
+    and view construction of `livelocals()`.
+
+    The handle binds to the frame when it is first used, and releases
+    it when the call returns. For generator and coroutine functions,
+    it is bound to the new generator's frame instead, and kept.
+
+    May be used as `@with_livelocals` or `@with_livelocals(name="scope")`.
+    Raises a TypeError if the function doesn't accept the argument.
+    """
+
+    if func is None:
+        return partial(with_livelocals, name=name)
+
+    code = func.__code__
+    layout = _layout(code)
+
+    argcount = code.co_argcount + getattr(code, "co_kwonlyargcount", 0)
+    if name not in code.co_varnames[:argcount]:
+        raise TypeError("%s() has no %r argument" % (code.co_name, name))
+
+    if code.co_flags & _SUSPENDS:
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            handle = kwargs[name] = LocalsHandle(code, layout)
+            result = func(*args, **kwargs)
+            handle._frame = _deferred_frame(result)
+            return result
+
+    else:
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            handle = kwargs[name] = LocalsHandle(code, layout,
+                                                 caller=sys._getframe())
+            try:
+                return func(*args, **kwargs)
+            finally:
+                handle._frame = handle._caller = None
+                handle._released = True
+
+    return wrapper
+
+
+# Layouts are a pure function of the code object, so they are shared
+# by every frame running that code.
+_layouts = WeakKeyDictionary()
+
+
+def _layout(code, _layouts=_layouts):
+    """
+    Returns a dict mapping each variable name declared by a code
+    object to a tuple of (index, getter, setter, deleter), where the
+    functions are the `_frame` accessors appropriate for that slot.
+    The result is cached per code object, and must not be modified.
+    """
+
+    found = _layouts.get(code, None)
+    if found is not None:
+        return found
+
+    found = {}
+
+    fast = (frame_get_fast, frame_set_fast, frame_del_fast)
+    cell = (frame_get_cell, frame_set_cell, frame_del_cell)
+
+    i = -1
+    for i, name in enumerate(code.co_varnames):
+        found[name] = (i, ) + fast
+
+    for i, name in enumerate(code.co_cellvars + code.co_freevars, i + 1):
+        found[name] = (i, ) + cell
+
+    _layouts[code] = found
+    return found
+
+
+def _compile_source(source):
+    """
+    Compiles source as an expression if possible, otherwise as a
+    statement. Returns a tuple of the code object and the names it
+    refers to.
+    """
+
+    try:
+        code = compile(source, "<evaluate>", "eval")
+    except SyntaxError:
+        code = compile(source, "<evaluate>", "exec")
+
+    return code, code.co_names
+
+
+class _CodeCache(object):
+    """
+    A bounded, least-recently-used cache of compiled source strings
+    for use by `evaluate()`.
+    """
+
+    __slots__ = ("maxsize", "_entries", "_lock", )
+
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def __contains__(self, source):
+        return source in self._entries
+
+
+    def get(self, source):
+        """
+        Returns a tuple of (code, names) for the given source,
+        compiling it if it is not already cached. Compilation errors
+        are raised and not cached.
+        """
+
+        entries = self._entries
+
+        # moving an entry to the end is a pop and a reinsert, which
+        # another thread mustn't interleave with
+        with self._lock:
+            found = entries.pop(source, None)
+            if found is not None:
+                entries[source] = found
+                return found
+
+        found = _compile_source(source)
+
+        with self._lock:
+            while entries and len(entries) >= self.maxsize:
+                entries.popitem(last=False)
+            entries[source] = found
+
+        return found
+
+
+    def clear(self):
+        """
+        Discards all of the cached code objects.
+        """
+
+        with self._lock:
+            self._entries.clear()
+
+
+# This is our default compiled source cache.
+_codes = _CodeCache()
+
+
+def evaluate(source, frame=None, writeback=False, _codes=_codes):
+    """
+    Evaluates source against a frame's globals and live local
+    variables, and returns the result. Source which isn't an
+    expression is executed as a statement, and None is returned.
+
+    Compiled code is kept in a bounded cache, and only the local
+    variables the code refers to are read from the frame. If writeback
+    is True, any of those variables which the code assigned or deleted
+    are then updated in the frame as well. For module and class body
+    frames, this includes names the code newly defined.
+
+    If frame is None, the calling frame is used.
+    """
+
+    if frame is None:
+        frame = currentframe().f_back
+
+    code, names = _codes.get(source)
+    layout = _layout(frame.f_code)
+    mapping = _frame_dict(frame)
+
+    scope = {}
+    for name in names:
+        found = layout.get(name, None)
+        if found is not None:
+            value = found[1](frame, found[0], _unbound)
+            if value is not _unbound:
+                scope[name] = value
+
+        elif mapping is not None and name in mapping:
+            scope[name] = mapping[name]
+
+    if not writeback:
+        return eval(code, frame.f_globals, scope)
+
+    before = dict(scope)
+    result = eval(code, frame.f_globals, scope)
+
+    for name in names:
+        value = scope.get(name, _unbound)
+        if value is before.get(name, _unbound):
+            continue
+
+        found = layout.get(name, None)
+        if found is not None:
+            if value is _unbound:
+                found[3](frame, found[0])
+            else:
+                found[2](frame, found[0], value)
+
+        elif mapping is not None:
+            if value is _unbound:
+                _dict_del(mapping, name)
+            else:
+                mapping[name] = value
+
+    return result
+
+
+def snapshot(frame=None, live_only=True):
+    """
+    Returns a dict of the defined local variables of a frame.
+
+    If live_only is True, fast variables which the frame's code can no
+    longer read from its current instruction are omitted, even if they
+    still hold a value. Cell and free variables are always included.
+    If liveness can't be determined, all defined variables are
+    included.
+
+    If frame is None, the calling frame is used.
+    """
+
+    if frame is None:
+        frame = currentframe().f_back
+
+    code = frame.f_code
+    live = live_names(frame) if live_only else None
+    nlocals = code.co_nlocals
+
+    found = {}
+    for name, (index, getter, _setter, _deleter) in _layout(code).items():
+        if live is not None and index < nlocals and name not in live:
+            continue
+
+        value = getter(frame, index, _unbound)
+        if value is not _unbound:
+            found[name] = value
+
+    return found
+
+
+def lookup_dynamic(name, frame=None, max_depth=None,
+                   default=_raise_error):
+    """
+    Returns the value of the variable name from the nearest frame on
+    the stack which both declares it and currently has it bound. The
+    search begins with frame and continues through its callers, and
+    examines at most max_depth frames if that is not None.
+
+    Each frame's code is checked against its cached layout, so frames
+    which don't declare the name are skipped with a single lookup.
+    Module and class body frames are checked by their locals mapping.
+
+    If no such frame is found, returns default if one was supplied,
+    otherwise raises a NameError.
+
+    If frame is None, the calling frame is used.
+    """
+
+    if frame is None:
+        frame = currentframe().f_back
+
+    depth = 0
+    while frame is not None:
+        if max_depth is not None and depth >= max_depth:
+            break
+
+        found = _layout(frame.f_code).get(name, None)
+        if found is not None:
+            value = found[1](frame, found[0], _unbound)
+            if value is not _unbound:
+                return value
+
+        else:
+            mapping = _frame_dict(frame)
+            if mapping is not None and name in mapping:
+                return mapping[name]
+
+        frame = frame.f_back
+        depth += 1
+
+    if default is _raise_error:
+        raise NameError("name %r is not defined" % name)
+    else:
+        return default
+
+
+class LocalsRecord(tuple):
+    """
+    Base class for the record types created by `record_type()`. A
+    record is a tuple of the values of a code object's fast, cell, and
+    free variables, in slot order, with UNBOUND in place of any
+    variable which had no value. Each value is also available as an
+    attribute named for its variable, except for names beginning and
+    ending with a double underscore, or which would hide a member of
+    this class.
+    """
+
+    __slots__ = ()
+
+    _name = None
+    _fields = ()
+
+
+    def __repr__(self):
+        values = ", ".join("%s=%r" % pair for pair in
+                           zip(self._fields, self))
+        return "%s(%s)" % (self._name, values)
+
+
+    def __reduce__(self):
+        return (_make_record, (self._name, self._fields, tuple(self)))
+
+
+    def _asdict(self):
+        """
+        Returns a dict of the bound variables of this record.
+        """
+
+        return dict((name, value) for name, value in
+                    zip(self._fields, self) if value is not UNBOUND)
+
+
+# Record types are shared by all code objects with the same name and
+# variables, which also allows records to be unpickled without the
+# code object.
+_records = WeakValueDictionary()
+
+
+def _record_class(name, fields, _records=_records):
+    """
+    Returns the LocalsRecord subclass for a code object name and tuple
+    of variable names, creating and caching it on first use.
+    """
+
+    key = (name, fields)
+    found = _records.get(key, None)
+    if found is not None:
+        return found
+
+    attrs = {"__slots__": (), "_name": name, "_fields": fields}
+
+    for index, field in enumerate(fields):
+        if field.startswith("__") and field.endswith("__"):
+            continue
+        if hasattr(LocalsRecord, field):
+            continue
+
+        # a cell variable which is also an argument appears twice,
+        # and its cell, which comes later, takes precedence
+        attrs[field] = property(itemgetter(index))
+
+    found = type("record", (LocalsRecord, ), attrs)
+    _records[key] = found
+
+    return found
+
+
+def _make_record(name, fields, values):
+    """
+    Recreates a pickled record.
+    """
+
+    return _record_class(name, fields)(values)
+
+
+_record_types = WeakKeyDictionary()
+
+
+def record_type(code, _record_types=_record_types):
+    """
+    Returns the LocalsRecord subclass whose fields are the fast, cell,
+    and free variable names of a code object. The result is cached per
+    code object.
+    """
+
+    found = _record_types.get(code, None)
+    if found is None:
+        fields = code.co_varnames + code.co_cellvars + code.co_freevars
+        found = _record_types[code] = _record_class(code.co_name, fields)
+
+    return found
+
+
+def snapshot_record(frame=None):
+    """
+    Returns a record of the current values of all of a frame's fast,
+    cell, and free variables, as an instance of the frame code's
+    `record_type()`. Unbound variables have the value UNBOUND.
+
+    Unlike `snapshot()`, this doesn't build a dict, and no liveness
+    filtering is applied. The record is filled in a single native call.
+
+    If frame is None, the calling frame is used.
+    """
+
+    if frame is None:
+        frame = currentframe().f_back
+
+    return frame_values(frame, UNBOUND, record_type(frame.f_code))
+
+
+_namespaces = WeakKeyDictionary()
+
+
+def _namespace_type(code, _namespaces=_namespaces):
+    """
+    Returns the FrameNamespace subclass for a code object, creating and
+    caching it on first use. Each of the code's variables is a SlotVar
+    descriptor on the class, bound to that variable's slot index.
+    Variable names which begin and end with a double underscore are
+    omitted, as they would conflict with the class machinery.
+    """
+
+    found = _namespaces.get(code, None)
+    if found is not None:
+        return found
+
+    nlocals = code.co_nlocals
+    attrs = {"__slots__": ()}
+
+    for name, (index, _getter, _setter, _deleter) in _layout(code).items():
+        if not (name.startswith("__") and name.endswith("__")):
+            attrs[name] = slotvar(name, index, index >= nlocals)
+
+    found = type("namespace", (FrameNamespace, ), attrs)
+    _namespaces[code] = found
+
+    return found
+
+
+def namespace(frame=None):
+    """
+    Returns an attribute-style view of a frame's fast, cell, and free
+    variables. Reading, assigning, or deleting an attribute acts
+    directly on the variable's slot in the frame. Reading a declared
+    but unassigned variable raises a NameError.
+
+    The namespace holds a reference to the frame, with the same
+    circular reference concerns as a LiveLocals instance.
+
+    If frame is None, the calling frame is used.
+    """
+
+    if frame is None:
+        frame = currentframe().f_back
+
+    return _namespace_type(frame.f_code)(frame)
+
+
 #
 # The end.
@@ -26,51 +26,228 @@
 #include <Python.h>
 #include <cellobject.h>
 #include <frameobject.h>
+#include <structmember.h>
 
 
 #define PARSE_ARGS PyArg_ParseTuple
 
 
+#if defined(__GNUC__)
+#define UNLIKELY(x) __builtin_expect(!!(x), 0)
+#else
+#define UNLIKELY(x) (x)
+#endif
+
+
+/* bits of hook_flags. When none are set, every hook is a single
+   untaken branch. */
+#define HOOK_STATS     0x01
+#define HOOK_CALLBACK  0x02
+#define HOOK_AUDIT     0x04
+#define HOOK_WRITES    (HOOK_CALLBACK | HOOK_AUDIT)
+
+
+typedef enum {
+  STAT_GET_FAST,
+  STAT_SET_FAST,
+  STAT_DEL_FAST,
+  STAT_GET_CELL,
+  STAT_SET_CELL,
+  STAT_DEL_CELL,
+  STAT_APPLY,
+  STAT_SLOTVAR_GET,
+  STAT_SLOTVAR_SET,
+  STAT_CLOSURE_GET,
+  STAT_CLOSURE_SET,
+  STAT_CLOSURE_DEL,
+  STAT_CLOSURE_REBIND,
+  STAT_NAME_ERROR,
+  STAT_RANGE_ERROR,
+  STAT_COUNT,
+} stat_id;
+
+
+static const char *stat_names[STAT_COUNT] = {
+  "frame_get_fast",
+  "frame_set_fast",
+  "frame_del_fast",
+  "frame_get_cell",
+  "frame_set_cell",
+  "frame_del_cell",
+  "frame_apply",
+  "slotvar_get",
+  "slotvar_set",
+  "closure_get",
+  "closure_set",
+  "closure_del",
+  "closure_rebind",
+  "name_error",
+  "range_error",
+};
+
+
 /**
-   Given a code object and index, set a NameError exception with the
-   appropriate variable name in the exception's message string.
+   Per-module state. Each interpreter which imports the module gets its
+   own, so hooks and counters enabled in one interpreter don't affect
+   another.
  */
-static void name_error(PyCodeObject *code, int index) {
-  PyObject *name = NULL;
+typedef struct {
+  int hook_flags;
+  PyObject *write_callback;
+  unsigned long long stats[STAT_COUNT];
+
+  PyTypeObject *namespace_type;
+  PyTypeObject *slotvar_type;
+
+#ifdef Py_GIL_DISABLED
+  /* Guards swapping the write callback while another thread may be
+     about to call it. The GIL already does this on other builds. */
+  PyMutex hook_lock;
+#endif
+} module_state;
+
+
+#if PY_MAJOR_VERSION >= 3
+
+static inline module_state *get_state(PyObject *mod) {
+  return (module_state *) PyModule_GetState(mod);
+}
+
+#else
+
+/* Python 2 only supports single-phase init, so there is only one. */
+static module_state global_state;
+
+static inline module_state *get_state(PyObject *mod) {
+  return &global_state;
+}
+
+#endif
+
+
+#if defined(Py_GIL_DISABLED) && defined(__GNUC__)
+#define STAT_INCR(st, stat) \
+  __atomic_fetch_add(&(st)->stats[stat], 1, __ATOMIC_RELAXED)
+#else
+#define STAT_INCR(st, stat) (st)->stats[stat]++
+#endif
+
+
+#define COUNT(st, stat) do {				\
+    if (UNLIKELY((st)->hook_flags & HOOK_STATS))	\
+      STAT_INCR(st, stat);				\
+  } while (0)
+
+
+#ifdef Py_GIL_DISABLED
+#define LOCK_HOOKS(st) PyMutex_Lock(&(st)->hook_lock)
+#define UNLOCK_HOOKS(st) PyMutex_Unlock(&(st)->hook_lock)
+#else
+#define LOCK_HOOKS(st)
+#define UNLOCK_HOOKS(st)
+#endif
+
+
+/* On free-threaded builds, writes to a frame's variables from these
+   accessors are serialized by a per-frame critical section. With the
+   GIL, these are plain blocks. Note that nothing can serialize these
+   against the frame's own thread while it is running. */
+#ifdef Py_GIL_DISABLED
+#define BEGIN_FRAME_CRITICAL(frame) \
+  Py_BEGIN_CRITICAL_SECTION((PyObject *) (frame))
+#define END_FRAME_CRITICAL() \
+  Py_END_CRITICAL_SECTION()
+#else
+#define BEGIN_FRAME_CRITICAL(frame) {
+#define END_FRAME_CRITICAL() }
+#endif
+
+
+/**
+   Given a code object and index, returns a borrowed reference to the
+   name of the fast, cell, or free variable at that index, or NULL if
+   the index is out of range. Does not set an exception.
+ */
+static PyObject *slot_name(PyCodeObject *code, int index) {
   int count = 0;
 
   count = code->co_nlocals;
-  if (index < count) {
-    name = PyTuple_GET_ITEM(code->co_varnames, index);
-    goto found;
-  }
+  if (index < count)
+    return PyTuple_GET_ITEM(code->co_varnames, index);
 
   index -= count;
   count = PyTuple_GET_SIZE(code->co_cellvars);
-  if (count && index < count) {
-    name = PyTuple_GET_ITEM(code->co_cellvars, index);
-    goto found;
-  }
+  if (index < count)
+    return PyTuple_GET_ITEM(code->co_cellvars, index);
 
   index -= count;
   count = PyTuple_GET_SIZE(code->co_freevars);
-  if (count && index < count) {
-    name = PyTuple_GET_ITEM(code->co_freevars, index);
-    goto found;
-  }
+  if (index < count)
+    return PyTuple_GET_ITEM(code->co_freevars, index);
+
+  return NULL;
+}
+
+
+/**
+   Given a code object and index, set a NameError exception with the
+   appropriate variable name in the exception's message string.
+ */
+static void name_error(module_state *st,
+		       PyCodeObject *code, int index) {
+  PyObject *name = slot_name(code, index);
 
-  PyErr_SetString(PyExc_NameError, "name <unknown> is not defined");
-  return;
+  COUNT(st, STAT_NAME_ERROR);
 
- found:
+  if (! name) {
+    PyErr_SetString(PyExc_NameError, "name <unknown> is not defined");
 
+  } else {
 #if PY_MAJOR_VERSION >= 3
-  PyErr_Format(PyExc_NameError, "name '%.200s' is not defined",
-	       PyUnicode_AsUTF8(name));
+    PyErr_Format(PyExc_NameError, "name '%.200s' is not defined",
+		 PyUnicode_AsUTF8(name));
 #else
-  PyErr_Format(PyExc_NameError, "name '%.200s' is not defined",
-	       PyString_AsString(name));
+    PyErr_Format(PyExc_NameError, "name '%.200s' is not defined",
+		 PyString_AsString(name));
 #endif
+  }
+}
+
+
+/**
+   If an optimized frame has a locals dict (because `locals()` was
+   called, or because a trace function is running) then update that
+   dict's entry for the variable at the given index to match the new
+   value, or remove the entry if value is NULL.
+
+   The interpreter copies that dict back over the frame's variables
+   when a trace function returns, which would otherwise revert any
+   write made from within the trace function.
+
+   Returns 0 on success, or -1 with an exception set.
+ */
+static int sync_locals(PyFrameObject *frame, int index, PyObject *value) {
+  PyObject *locals = frame->f_locals;
+  PyObject *name = NULL;
+
+  if (! locals || ! PyDict_Check(locals) ||
+      ! (frame->f_code->co_flags & CO_OPTIMIZED))
+    return 0;
+
+  name = slot_name(frame->f_code, index);
+  if (! name)
+    return 0;
+
+  if (value)
+    return PyDict_SetItem(locals, name, value);
+
+  if (PyDict_DelItem(locals, name)) {
+    if (! PyErr_ExceptionMatches(PyExc_KeyError))
+      return -1;
+    PyErr_Clear();
+  }
+
+  return 0;
 }
 
 
@@ -79,9 +256,11 @@ static void name_error(PyCodeObject *code, int index) {
    fast locals. Otherwise, sets a ValueError to indicate that the
    index is out-of-range and returns 0.
  */
-static inline int valid_fast_index(PyCodeObject *code, int index) {
+static inline int valid_fast_index(module_state *st,
+				   PyCodeObject *code, int index) {
   if (index < 0 || index >= code->co_nlocals) {
 
+    COUNT(st, STAT_RANGE_ERROR);
     PyErr_Format(PyExc_ValueError, "fast index %i out of range", index);
     return 0;
 
@@ -96,12 +275,14 @@ static inline int valid_fast_index(PyCodeObject *code, int index) {
    cell or free locals. Otherwise, sets a ValueError to indicate that
    the index is out-of-range and returns 0.
  */
-static inline int valid_cell_index(PyCodeObject *code, int index) {
+static inline int valid_cell_index(module_state *st,
+				   PyCodeObject *code, int index) {
   if ((index < code->co_nlocals) ||
       (index >= (code->co_nlocals +
 		 PyTuple_GET_SIZE(code->co_cellvars) +
 		 PyTuple_GET_SIZE(code->co_freevars)))) {
 
+    COUNT(st, STAT_RANGE_ERROR);
     PyErr_Format(PyExc_ValueError, "cell index %i out of range", index);
     return 0;
 
@@ -111,6 +292,166 @@ static inline int valid_cell_index(PyCodeObject *code, int index) {
 }
 
 
+/**
+   Reports a write to the variable at index of frame to the write
+   callback and as an audit event, as enabled. old and value may be
+   NULL for an unbound variable, and are passed on as None. Returns 0
+   on success, or -1 with an exception set.
+ */
+static int notify_write(module_state *st,
+			PyFrameObject *frame, int index,
+			PyObject *old, PyObject *value) {
+
+  PyObject *name = slot_name(frame->f_code, index);
+  PyObject *callback = NULL;
+  PyObject *result = NULL;
+
+  if (! name)
+    name = Py_None;
+  if (! old)
+    old = Py_None;
+  if (! value)
+    value = Py_None;
+
+#if PY_VERSION_HEX >= 0x03080000
+  if (st->hook_flags & HOOK_AUDIT) {
+    if (PySys_Audit("livelocals.write", "OOOO",
+		    (PyObject *) frame, name, old, value) < 0)
+      return -1;
+  }
+#endif
+
+  if (st->hook_flags & HOOK_CALLBACK) {
+    LOCK_HOOKS(st);
+    callback = st->write_callback;
+    Py_XINCREF(callback);
+    UNLOCK_HOOKS(st);
+
+    if (callback) {
+      result = PyObject_CallFunctionObjArgs(callback, (PyObject *) frame,
+					    name, old, value, NULL);
+      Py_DECREF(callback);
+
+      if (! result)
+	return -1;
+      Py_DECREF(result);
+    }
+  }
+
+  return 0;
+}
+
+
+/**
+   Returns a new reference to the value of a frame's fast variable at
+   an index already known to be valid, or NULL without an exception if
+   the variable is unbound.
+
+   Without the GIL, the load and incref must not be interleaved with
+   another accessor's write to the same slot.
+ */
+static inline PyObject *fast_get(PyFrameObject *frame, int index) {
+  PyObject *result = NULL;
+
+  BEGIN_FRAME_CRITICAL(frame);
+  result = frame->f_localsplus[index];
+  Py_XINCREF(result);
+  END_FRAME_CRITICAL();
+
+  return result;
+}
+
+
+/**
+   Assigns (or clears, if value is NULL) a frame's fast variable at an
+   index already known to be valid. Returns 0 on success, or -1 with
+   an exception set.
+ */
+static int fast_set(module_state *st,
+		    PyFrameObject *frame, int index, PyObject *value) {
+  PyObject *old = NULL;
+  int result = 0;
+
+  Py_XINCREF(value);
+
+  BEGIN_FRAME_CRITICAL(frame);
+  old = frame->f_localsplus[index];
+  frame->f_localsplus[index] = value;
+  result = sync_locals(frame, index, value);
+  END_FRAME_CRITICAL();
+
+  if (UNLIKELY(st->hook_flags & HOOK_WRITES) && ! result)
+    result = notify_write(st, frame, index, old, value);
+
+  Py_XDECREF(old);
+  return result;
+}
+
+
+/**
+   Returns a new reference to the value of a frame's cell or free
+   variable at an index already known to be valid, or NULL without an
+   exception if the variable is unbound.
+
+   This needs no lock of its own. The cell objects of a frame are never
+   replaced, and PyCell_Get is itself safe without the GIL. A frame
+   that has been cleared (eg. by traceback.clear_frames) has no cells
+   at all, and its variables all read as unbound.
+ */
+static inline PyObject *cell_get(PyFrameObject *frame, int index) {
+  PyObject *cell = frame->f_localsplus[index];
+  return cell? PyCell_Get(cell): NULL;
+}
+
+
+/**
+   Sets a ValueError and returns 1 if a frame's cell or free variable
+   at an index already known to be valid has lost its cell to the
+   frame being cleared, otherwise returns 0.
+ */
+static int cell_cleared(PyFrameObject *frame, int index) {
+  if (frame->f_localsplus[index])
+    return 0;
+
+  PyErr_Format(PyExc_ValueError,
+	       "cell index %i was cleared with its frame", index);
+  return 1;
+}
+
+
+/**
+   Assigns (or clears, if value is NULL) a frame's cell or free
+   variable at an index already known to be valid. Returns 0 on
+   success, or -1 with an exception set.
+ */
+static int cell_set(module_state *st,
+		    PyFrameObject *frame, int index, PyObject *value) {
+  PyObject *old = NULL;
+  int result = 0;
+
+  if (cell_cleared(frame, index))
+    return -1;
+
+  BEGIN_FRAME_CRITICAL(frame);
+
+  if (UNLIKELY(st->hook_flags & HOOK_WRITES))
+    old = PyCell_Get(frame->f_localsplus[index]);
+
+  result = PyCell_Set(frame->f_localsplus[index], value);
+
+  if (! result)
+    result = sync_locals(frame, index, value);
+
+  END_FRAME_CRITICAL();
+
+  if (UNLIKELY(st->hook_flags & HOOK_WRITES) && ! result)
+    result = notify_write(st, frame, index, old, value);
+
+  Py_XDECREF(old);
+  return result;
+}
+
+
 /**
    Returns the value of a frame's fast local variable at the given
    index.
@@ -123,26 +464,25 @@ static inline int valid_cell_index(PyCodeObject *code, int index) {
  */
 static PyObject *frame_get_fast(PyObject *self, PyObject *args) {
 
+  module_state *st = get_state(self);
   PyFrameObject *frame = NULL;
   int index = -1;
   PyObject *defval = NULL;
-  PyObject **fast = NULL;
   PyObject *result = NULL;
 
+  COUNT(st, STAT_GET_FAST);
+
   if (! PARSE_ARGS(args, "O!i|O", &PyFrame_Type, &frame, &index, &defval))
     return NULL;
 
-  if (! valid_fast_index(frame->f_code, index))
+  if (! valid_fast_index(st, frame->f_code, index))
     return NULL;
 
-  fast = frame->f_localsplus;
-
-  result = fast[index];
-  Py_XINCREF(result);
+  result = fast_get(frame, index);
 
   if (! result) {
     if (! defval) {
-      name_error(frame->f_code, index);
+      name_error(st, frame->f_code, index);
 
     } else {
       Py_INCREF(defval);
@@ -164,22 +504,21 @@ static PyObject *frame_get_fast(PyObject *self, PyObject *args) {
    _frame.frame_set_fast(frame_obj, index, value)
  */
 static PyObject *frame_set_fast(PyObject *self, PyObject *args) {
+  module_state *st = get_state(self);
   PyFrameObject *frame = NULL;
   int index = -1;
   PyObject *value = NULL;
-  PyObject **fast = NULL;
+
+  COUNT(st, STAT_SET_FAST);
 
   if (! PARSE_ARGS(args, "O!iO", &PyFrame_Type, &frame, &index, &value))
     return NULL;
 
-  if (! valid_fast_index(frame->f_code, index))
+  if (! valid_fast_index(st, frame->f_code, index))
     return NULL;
 
-  fast = frame->f_localsplus;
-
-  Py_CLEAR(fast[index]);
-  fast[index] = value;
-  Py_INCREF(value);
+  if (fast_set(st, frame, index, value))
+    return NULL;
 
   Py_RETURN_NONE;
 }
@@ -195,18 +534,20 @@ static PyObject *frame_set_fast(PyObject *self, PyObject *args) {
    _frame.frame_del_fast(frame_obj, index)
  */
 static PyObject *frame_del_fast(PyObject *self, PyObject *args) {
+  module_state *st = get_state(self);
   PyFrameObject *frame = NULL;
   int index = -1;
-  PyObject **fast = NULL;
+
+  COUNT(st, STAT_DEL_FAST);
 
   if (! PARSE_ARGS(args, "O!i", &PyFrame_Type, &frame, &index))
     return NULL;
 
-  if (! valid_fast_index(frame->f_code, index))
+  if (! valid_fast_index(st, frame->f_code, index))
     return NULL;
 
-  fast = frame->f_localsplus;
-  Py_CLEAR(fast[index]);
+  if (fast_set(st, frame, index, NULL))
+    return NULL;
 
   Py_RETURN_NONE;
 }
@@ -224,24 +565,25 @@ static PyObject *frame_del_fast(PyObject *self, PyObject *args) {
  */
 static PyObject *frame_get_cell(PyObject *self, PyObject *args) {
 
+  module_state *st = get_state(self);
   PyFrameObject *frame = NULL;
   int index = -1;
   PyObject *defval = NULL;
-  PyObject **fast = NULL;
   PyObject *result = NULL;
 
+  COUNT(st, STAT_GET_CELL);
+
   if (! PARSE_ARGS(args, "O!i|O", &PyFrame_Type, &frame, &index, &defval))
     return NULL;
 
-  if (! valid_cell_index(frame->f_code, index))
+  if (! valid_cell_index(st, frame->f_code, index))
     return NULL;
 
-  fast = frame->f_localsplus;
-  result = PyCell_Get(fast[index]);
+  result = cell_get(frame, index);
 
   if (! result) {
     if (! defval) {
-      name_error(frame->f_code, index);
+      name_error(st, frame->f_code, index);
 
     } else {
       Py_INCREF(defval);
@@ -263,19 +605,21 @@ static PyObject *frame_get_cell(PyObject *self, PyObject *args) {
    _frame.frame_set_cell(frame_obj, index, value)
  */
 static PyObject *frame_set_cell(PyObject *self, PyObject *args) {
+  module_state *st = get_state(self);
   PyFrameObject *frame = NULL;
   PyObject *value = NULL;
   int index = -1;
-  PyObject **fast = NULL;
+
+  COUNT(st, STAT_SET_CELL);
 
   if (! PARSE_ARGS(args, "O!iO", &PyFrame_Type, &frame, &index, &value))
     return NULL;
 
-  if (! valid_cell_index(frame->f_code, index))
+  if (! valid_cell_index(st, frame->f_code, index))
     return NULL;
 
-  fast = frame->f_localsplus;
-  PyCell_Set(fast[index], value);
+  if (cell_set(st, frame, index, value))
+    return NULL;
 
   Py_RETURN_NONE;
 }
@@ -291,87 +635,1307 @@ static PyObject *frame_set_cell(PyObject *self, PyObject *args) {
    _frame.frame_del_cell(frame_obj, index)
  */
 static PyObject *frame_del_cell(PyObject *self, PyObject *args) {
+  module_state *st = get_state(self);
   PyFrameObject *frame = NULL;
   int index = -1;
-  PyObject **fast = NULL;
+
+  COUNT(st, STAT_DEL_CELL);
 
   if (! PARSE_ARGS(args, "O!i", &PyFrame_Type, &frame, &index))
     return NULL;
 
-  if (! valid_cell_index(frame->f_code, index))
+  if (! valid_cell_index(st, frame->f_code, index))
     return NULL;
 
-  fast = frame->f_localsplus;
-  PyCell_Set(fast[index], NULL);
+  if (cell_set(st, frame, index, NULL))
+    return NULL;
 
   Py_RETURN_NONE;
 }
 
 
-static PyMethodDef methods[] = {
-  { "frame_get_fast",
-    (PyCFunction) frame_get_fast, METH_VARARGS,
-    "Get the value of a fast variable in a frame. Raises a ValueError"
-    " if the index is out of range. Raises a NameError if the variable"
-    " is not currently defined."},
+/**
+   Applies a batch of writes to a frame's fast, cell, and free
+   variables. writes is a tuple of (index, value) pairs, where a value
+   of unbound clears the variable instead.
 
-  { "frame_set_fast",
-    (PyCFunction) frame_set_fast, METH_VARARGS,
-    "Set the value of a fast variable in a frame. Raises a ValueError"
-    " if the index is out of range." },
+   Every write is validated before any is applied, so on error the
+   frame is left unchanged. The slots are then all assigned without
+   running any Python code, so no other thread or signal handler can
+   observe the frame with only some of the writes applied. Only once
+   every slot has its new value is the frame's locals dict (if any)
+   synced, are the hooks notified, and are the old values released.
 
-  { "frame_del_fast",
-    (PyCFunction) frame_del_fast, METH_VARARGS,
-    "Clear the value of a fast variable in a frame, marking it as"
-    " undefined until a new value is set. Raises a ValueError if the"
-    " index is out of range." },
+   From Python:
+   _frame.frame_apply(frame_obj, ((index, value), ...), unbound)
+ */
+static PyObject *frame_apply(PyObject *self, PyObject *args) {
+  module_state *st = get_state(self);
+  PyFrameObject *frame = NULL;
+  PyObject *writes = NULL;
+  PyObject *unbound = NULL;
+  PyObject *olds = NULL;
+  PyObject *item = NULL;
+  PyObject *value = NULL;
+  PyObject **slot = NULL;
+  PyCodeObject *code = NULL;
+  Py_ssize_t count, pos;
+  int nlocals, total, index;
+  int result = 0;
 
-  { "frame_get_cell",
-    (PyCFunction) frame_get_cell, METH_VARARGS,
-    "Get the value of a cell or free variable in a frame. Raises a"
-    " ValueError if the index is out of range. Raises a NameError if"
-    " the variable is not currently defined." },
+  COUNT(st, STAT_APPLY);
 
-  { "frame_set_cell",
-    (PyCFunction) frame_set_cell, METH_VARARGS,
-    "Set the value of a cell or free variable in a frame. Raises a"
-    " ValueError if the index is out of range." },
+  if (! PARSE_ARGS(args, "O!O!O", &PyFrame_Type, &frame,
+		   &PyTuple_Type, &writes, &unbound))
+    return NULL;
 
-  { "frame_del_cell",
-    (PyCFunction) frame_del_cell, METH_VARARGS,
-    "Clear the value of a cell or free variable in a frame, marking"
-    " it as undefined until a new value is set. Raises a ValueError if"
-    " the index is out of range." },
+  code = frame->f_code;
+  nlocals = code->co_nlocals;
+  total = nlocals +
+    (int) PyTuple_GET_SIZE(code->co_cellvars) +
+    (int) PyTuple_GET_SIZE(code->co_freevars);
 
-  { NULL, NULL, 0, NULL },
-};
+  count = PyTuple_GET_SIZE(writes);
+
+  for (pos = 0; pos < count; pos++) {
+    item = PyTuple_GET_ITEM(writes, pos);
+    if (! PyTuple_Check(item) || PyTuple_GET_SIZE(item) != 2) {
+      PyErr_SetString(PyExc_TypeError,
+		      "writes must be a tuple of (index, value) pairs");
+      return NULL;
+    }
 
+    index = (int) PyLong_AsLong(PyTuple_GET_ITEM(item, 0));
+    if (index == -1 && PyErr_Occurred())
+      return NULL;
 
-#if PY_MAJOR_VERSION >= 3
-/* Python 3 Mode */
+    if (index < 0 || index >= total) {
+      COUNT(st, STAT_RANGE_ERROR);
+      PyErr_Format(PyExc_ValueError, "index %i out of range", index);
+      return NULL;
+    }
 
+    if (index >= nlocals && cell_cleared(frame, index))
+      return NULL;
+  }
 
-static struct PyModuleDef moduledef = {
-  PyModuleDef_HEAD_INIT,
-  "livelocals._frame",
-  NULL,
-  -1,
-  methods,
-};
+  /* allocated up front, so that nothing can fail once writing has
+     begun. Holds the old values until every write is complete */
+  olds = PyTuple_New(count);
+  if (! olds)
+    return NULL;
+
+  BEGIN_FRAME_CRITICAL(frame);
+
+  for (pos = 0; pos < count; pos++) {
+    item = PyTuple_GET_ITEM(writes, pos);
+    index = (int) PyLong_AsLong(PyTuple_GET_ITEM(item, 0));
+    value = PyTuple_GET_ITEM(item, 1);
+
+    if (value == unbound)
+      value = NULL;
+    Py_XINCREF(value);
+
+    slot = frame->f_localsplus + index;
+
+    if (index < nlocals) {
+      PyTuple_SET_ITEM(olds, pos, *slot);
+      *slot = value;
+
+    } else {
+      /* PyCell_Set would release the old value immediately */
+      PyTuple_SET_ITEM(olds, pos, PyCell_GET(*slot));
+      PyCell_SET(*slot, value);
+    }
+  }
+
+  for (pos = 0; pos < count && ! result; pos++) {
+    item = PyTuple_GET_ITEM(writes, pos);
+    index = (int) PyLong_AsLong(PyTuple_GET_ITEM(item, 0));
+    value = PyTuple_GET_ITEM(item, 1);
+
+    result = sync_locals(frame, index, value == unbound? NULL: value);
+  }
+
+  END_FRAME_CRITICAL();
+
+  if (UNLIKELY(st->hook_flags & HOOK_WRITES)) {
+    for (pos = 0; pos < count && ! result; pos++) {
+      item = PyTuple_GET_ITEM(writes, pos);
+      index = (int) PyLong_AsLong(PyTuple_GET_ITEM(item, 0));
+      value = PyTuple_GET_ITEM(item, 1);
+
+      result = notify_write(st, frame, index, PyTuple_GET_ITEM(olds, pos),
+			    value == unbound? NULL: value);
+    }
+  }
 
+  Py_DECREF(olds);
+
+  if (result)
+    return NULL;
 
-PyMODINIT_FUNC PyInit__frame() {
-  Py_Initialize();
-  return PyModule_Create(&moduledef);
+  Py_RETURN_NONE;
 }
 
 
-#else
-/* Python 2 Mode */
+/**
+   Returns a tuple of the values of all of a frame's fast, cell, and
+   free variables, in slot order. Unbound variables are given the
+   value of unbound. If type is specified, it must be a subtype of
+   tuple, and the result is allocated as an instance of that type
+   rather than as a plain tuple.
+
+   From Python:
+   values = _frame.frame_values(frame_obj, unbound)
+   record = _frame.frame_values(frame_obj, unbound, record_type)
+ */
+static PyObject *frame_values(PyObject *self, PyObject *args) {
+  PyFrameObject *frame = NULL;
+  PyObject *unbound = NULL;
+  PyTypeObject *type = &PyTuple_Type;
+  PyCodeObject *code = NULL;
+  PyObject *result = NULL;
+  PyObject *value = NULL;
+  Py_ssize_t nlocals, count, index;
+
+  if (! PARSE_ARGS(args, "O!O|O!", &PyFrame_Type, &frame, &unbound,
+		   &PyType_Type, &type))
+    return NULL;
+
+  if (! PyType_IsSubtype(type, &PyTuple_Type)) {
+    PyErr_SetString(PyExc_TypeError, "type must be a subtype of tuple");
+    return NULL;
+  }
+
+  code = frame->f_code;
+  nlocals = code->co_nlocals;
+  count = nlocals +
+    PyTuple_GET_SIZE(code->co_cellvars) +
+    PyTuple_GET_SIZE(code->co_freevars);
+
+  if (type == &PyTuple_Type)
+    result = PyTuple_New(count);
+  else
+    result = type->tp_alloc(type, count);
+
+  if (! result)
+    return NULL;
+
+  for (index = 0; index < count; index++) {
+    if (index < nlocals)
+      value = fast_get(frame, index);
+    else
+      value = cell_get(frame, index);
+
+    if (! value) {
+      Py_INCREF(unbound);
+      value = unbound;
+    }
+
+    PyTuple_SET_ITEM(result, index, value);
+  }
+
+  return result;
+}
+
+
+/**
+   Compares the current values of a frame's fast, cell, and free
+   variables against a list of their previous values, by identity.
+   Each slot which differs is updated in the list, and returned in a
+   tuple of (index, value) pairs. Unbound variables are given the
+   value of unbound. Returns an empty tuple if nothing has changed.
+
+   From Python:
+   previous = [unbound] * slot_count
+   changes = _frame.frame_diff(frame_obj, previous, unbound)
+ */
+static PyObject *frame_diff(PyObject *self, PyObject *args) {
+  PyFrameObject *frame = NULL;
+  PyObject *previous = NULL;
+  PyObject *unbound = NULL;
+  PyCodeObject *code = NULL;
+  PyObject *changes = NULL;
+  PyObject *change = NULL;
+  PyObject *value = NULL;
+  PyObject *result = NULL;
+  Py_ssize_t nlocals, count, index;
+
+  if (! PARSE_ARGS(args, "O!O!O", &PyFrame_Type, &frame,
+		   &PyList_Type, &previous, &unbound))
+    return NULL;
+
+  code = frame->f_code;
+  nlocals = code->co_nlocals;
+  count = nlocals +
+    PyTuple_GET_SIZE(code->co_cellvars) +
+    PyTuple_GET_SIZE(code->co_freevars);
+
+  if (PyList_GET_SIZE(previous) != count) {
+    PyErr_Format(PyExc_ValueError, "expected %zd previous values", count);
+    return NULL;
+  }
+
+  for (index = 0; index < count; index++) {
+    if (index < nlocals)
+      value = fast_get(frame, index);
+    else
+      value = cell_get(frame, index);
+
+    if (! value) {
+      Py_INCREF(unbound);
+      value = unbound;
+    }
+
+    if (value == PyList_GET_ITEM(previous, index)) {
+      Py_DECREF(value);
+      continue;
+    }
+
+    if (! changes) {
+      changes = PyList_New(0);
+      if (! changes)
+	goto error;
+    }
+
+    change = Py_BuildValue("(nO)", index, value);
+    if (! change || PyList_Append(changes, change))
+      goto error;
+    Py_CLEAR(change);
+
+    /* steals the reference to value */
+    PyList_SetItem(previous, index, value);
+  }
+
+  if (changes) {
+    result = PyList_AsTuple(changes);
+    Py_DECREF(changes);
+  } else {
+    result = PyTuple_New(0);
+  }
+
+  return result;
+
+ error:
+  Py_XDECREF(change);
+  Py_XDECREF(changes);
+  Py_DECREF(value);
+  return NULL;
+}
+
+
+/**
+   Returns the dict (or other mapping) holding the variables of a frame
+   whose code isn't optimized, such as a module or class body. This is
+   the frame's own f_locals, and not a copy, so unlike the f_locals
+   attribute of a frame it doesn't first merge in the fast and cell
+   variables. Returns None if the frame has no such mapping.
+
+   From Python:
+   mapping = _frame.frame_get_locals(frame_obj)
+ */
+static PyObject *frame_get_locals(PyObject *self, PyObject *args) {
+  PyFrameObject *frame = NULL;
+  PyObject *result = NULL;
+
+  if (! PARSE_ARGS(args, "O!", &PyFrame_Type, &frame))
+    return NULL;
+
+  BEGIN_FRAME_CRITICAL(frame);
+  result = frame->f_locals? frame->f_locals: Py_None;
+  Py_INCREF(result);
+  END_FRAME_CRITICAL();
+
+  return result;
+}
+
+
+/**
+   Returns 1 if the index is valid within the range of a function's
+   free variables. Otherwise, sets a ValueError to indicate that the
+   index is out-of-range and returns 0.
+ */
+static inline int valid_closure_index(module_state *st,
+				      PyObject *func, int index) {
+  PyObject *closure = PyFunction_GET_CLOSURE(func);
+
+  if (index < 0 || ! closure || index >= PyTuple_GET_SIZE(closure)) {
+
+    COUNT(st, STAT_RANGE_ERROR);
+    PyErr_Format(PyExc_ValueError, "closure index %i out of range", index);
+    return 0;
+
+  } else {
+    return 1;
+  }
+}
+
+
+/**
+   Sets a NameError for the free variable of a function at an index
+   already known to be valid.
+ */
+static void closure_name_error(module_state *st,
+			       PyObject *func, int index) {
+  PyCodeObject *code = (PyCodeObject *) PyFunction_GET_CODE(func);
+
+  name_error(st, code, (code->co_nlocals +
+			(int) PyTuple_GET_SIZE(code->co_cellvars) +
+			index));
+}
+
+
+/**
+   Returns the value of a function's free variable at the given index
+   of its closure. No frame is needed, so this works whether or not
+   the function is running.
+
+   Raises a ValueError if the index is out of range, or a NameError if
+   the variable is not currently assigned a value.
+
+   From Python:
+   value = _frame.closure_get(func, index)
+ */
+static PyObject *closure_get(PyObject *self, PyObject *args) {
+
+  module_state *st = get_state(self);
+  PyObject *func = NULL;
+  int index = -1;
+  PyObject *defval = NULL;
+  PyObject *result = NULL;
+
+  COUNT(st, STAT_CLOSURE_GET);
+
+  if (! PARSE_ARGS(args, "O!i|O", &PyFunction_Type, &func, &index, &defval))
+    return NULL;
+
+  if (! valid_closure_index(st, func, index))
+    return NULL;
+
+  result = PyCell_Get(PyTuple_GET_ITEM(PyFunction_GET_CLOSURE(func), index));
+
+  if (! result) {
+    if (! defval) {
+      closure_name_error(st, func, index);
+
+    } else {
+      Py_INCREF(defval);
+      result = defval;
+    }
+  }
+
+  return result;
+}
+
+
+/**
+   Assigns the value of a function's free variable at the given index
+   of its closure. The cell is shared with the function's defining
+   scope and with any other closures created from that scope.
+
+   Raises a ValueError if the index is out of range.
+
+   From Python:
+   _frame.closure_set(func, index, value)
+ */
+static PyObject *closure_set(PyObject *self, PyObject *args) {
+  module_state *st = get_state(self);
+  PyObject *func = NULL;
+  PyObject *value = NULL;
+  int index = -1;
+
+  COUNT(st, STAT_CLOSURE_SET);
+
+  if (! PARSE_ARGS(args, "O!iO", &PyFunction_Type, &func, &index, &value))
+    return NULL;
+
+  if (! valid_closure_index(st, func, index))
+    return NULL;
+
+  if (PyCell_Set(PyTuple_GET_ITEM(PyFunction_GET_CLOSURE(func), index),
+		 value))
+    return NULL;
+
+  Py_RETURN_NONE;
+}
+
+
+/**
+   Clears the value of a function's free variable at the given index
+   of its closure, leaving it declared but undefined.
+
+   Raises a ValueError if the index is out of range.
+
+   From Python:
+   _frame.closure_del(func, index)
+ */
+static PyObject *closure_del(PyObject *self, PyObject *args) {
+  module_state *st = get_state(self);
+  PyObject *func = NULL;
+  int index = -1;
+
+  COUNT(st, STAT_CLOSURE_DEL);
+
+  if (! PARSE_ARGS(args, "O!i", &PyFunction_Type, &func, &index))
+    return NULL;
+
+  if (! valid_closure_index(st, func, index))
+    return NULL;
+
+  if (PyCell_Set(PyTuple_GET_ITEM(PyFunction_GET_CLOSURE(func), index),
+		 NULL))
+    return NULL;
+
+  Py_RETURN_NONE;
+}
+
+
+/**
+   Returns the index of name in a code object's free variables, or -1
+   if it isn't one of them. Sets an exception and returns -2 if the
+   comparison fails.
+ */
+static int freevar_index(PyCodeObject *code, PyObject *name) {
+  PyObject *freevars = code->co_freevars;
+  Py_ssize_t count = PyTuple_GET_SIZE(freevars);
+  Py_ssize_t index;
+  int found;
+
+  /* the names of a code object are interned, so this is the usual
+     match */
+  for (index = 0; index < count; index++) {
+    if (PyTuple_GET_ITEM(freevars, index) == name)
+      return (int) index;
+  }
+
+  for (index = 0; index < count; index++) {
+    found = PyObject_RichCompareBool(PyTuple_GET_ITEM(freevars, index),
+				     name, Py_EQ);
+    if (found < 0)
+      return -2;
+    if (found)
+      return (int) index;
+  }
+
+  return -1;
+}
+
+
+/**
+   Assigns value to the free variable with the given name in each of
+   an iterable of functions. The index of the name is looked up once
+   for each run of functions sharing a code object, as is typical of
+   closures created by the same factory.
+
+   Every function is checked before any is assigned, so if one isn't a
+   function, or doesn't have such a free variable, nothing is changed.
+   The cells are then all assigned without running any Python code,
+   and only afterwards are their old values released. funcs is copied
+   first, so that code run by a comparison or a release can't change
+   it underneath the loops. Returns the number of functions rebound.
+
+   From Python:
+   count = _frame.closure_rebind(funcs, name, value)
+ */
+static PyObject *closure_rebind(PyObject *self, PyObject *args) {
+  module_state *st = get_state(self);
+  PyObject *funcs = NULL;
+  PyObject *name = NULL;
+  PyObject *value = NULL;
+  PyObject *seq = NULL;
+  PyObject *olds = NULL;
+  PyObject *func = NULL;
+  PyObject *cell = NULL;
+  PyCodeObject *code = NULL;
+  PyCodeObject *last = NULL;
+  int *indexes = NULL;
+  Py_ssize_t count, pos;
+  int index = -1;
+
+  COUNT(st, STAT_CLOSURE_REBIND);
+
+  if (! PARSE_ARGS(args, "OOO", &funcs, &name, &value))
+    return NULL;
+
+  seq = PySequence_Tuple(funcs);
+  if (! seq)
+    return NULL;
+
+  count = PyTuple_GET_SIZE(seq);
+
+  indexes = PyMem_New(int, count? count: 1);
+  if (! indexes) {
+    Py_DECREF(seq);
+    return PyErr_NoMemory();
+  }
+
+  for (pos = 0; pos < count; pos++) {
+    func = PyTuple_GET_ITEM(seq, pos);
+
+    if (! PyFunction_Check(func)) {
+      PyErr_Format(PyExc_TypeError, "expected function, not '%.200s'",
+		   Py_TYPE(func)->tp_name);
+      goto error;
+    }
+
+    code = (PyCodeObject *) PyFunction_GET_CODE(func);
+    if (code != last) {
+      index = freevar_index(code, name);
+      if (index == -2)
+	goto error;
+      last = code;
+    }
+
+    if (index < 0 || ! valid_closure_index(st, func, index)) {
+      if (index < 0)
+	PyErr_SetObject(PyExc_KeyError, name);
+      goto error;
+    }
+
+    indexes[pos] = index;
+  }
+
+  /* allocated up front, so that nothing can fail once writing has
+     begun. Holds the old values until every write is complete */
+  olds = PyTuple_New(count);
+  if (! olds)
+    goto error;
+
+  for (pos = 0; pos < count; pos++) {
+    func = PyTuple_GET_ITEM(seq, pos);
+    cell = PyTuple_GET_ITEM(PyFunction_GET_CLOSURE(func), indexes[pos]);
+
+    /* PyCell_Set would release the old value immediately */
+    Py_INCREF(value);
+    PyTuple_SET_ITEM(olds, pos, PyCell_GET(cell));
+    PyCell_SET(cell, value);
+  }
+
+  PyMem_Free(indexes);
+  Py_DECREF(seq);
+  Py_DECREF(olds);
+  return PyLong_FromSsize_t(count);
+
+ error:
+  PyMem_Free(indexes);
+  Py_DECREF(seq);
+  return NULL;
+}
+
+
+/**
+   A FrameNamespace holds a reference to a frame. It has no attributes
+   of its own, but is subclassed per code object with a SlotVar
+   descriptor for each of that code's variables.
+ */
+typedef struct {
+  PyObject_HEAD
+  PyFrameObject *frame;
+} FrameNamespace;
+
+
+static PyObject *namespace_new(PyTypeObject *type,
+			       PyObject *args, PyObject *kwds) {
+
+  PyFrameObject *frame = NULL;
+  FrameNamespace *self = NULL;
+
+  if (! PARSE_ARGS(args, "O!", &PyFrame_Type, &frame))
+    return NULL;
+
+  self = (FrameNamespace *) type->tp_alloc(type, 0);
+  if (! self)
+    return NULL;
+
+  Py_INCREF(frame);
+  self->frame = frame;
+
+  return (PyObject *) self;
+}
+
+
+static int namespace_traverse(FrameNamespace *self,
+			      visitproc visit, void *arg) {
+#if PY_VERSION_HEX >= 0x03090000
+  Py_VISIT(Py_TYPE(self));
+#endif
+  Py_VISIT(self->frame);
+  return 0;
+}
+
+
+static int namespace_clear(FrameNamespace *self) {
+  Py_CLEAR(self->frame);
+  return 0;
+}
+
+
+static void namespace_dealloc(FrameNamespace *self) {
+  PyTypeObject *type = Py_TYPE(self);
+
+  PyObject_GC_UnTrack(self);
+  namespace_clear(self);
+  type->tp_free((PyObject *) self);
+
+#if PY_VERSION_HEX >= 0x03080000
+  /* instances of heap types own a reference to their type */
+  Py_DECREF(type);
+#endif
+}
+
+
+static PyObject *namespace_repr(FrameNamespace *self) {
+#if PY_MAJOR_VERSION >= 3
+  return PyUnicode_FromFormat("<namespace for frame at %p>", self->frame);
+#else
+  return PyString_FromFormat("<namespace for frame at %p>", self->frame);
+#endif
+}
+
+
+static PyObject *namespace_get_frame(FrameNamespace *self, void *closure) {
+  PyObject *frame = self->frame? (PyObject *) self->frame: Py_None;
+  Py_INCREF(frame);
+  return frame;
+}
+
+
+static PyGetSetDef namespace_getset[] = {
+  { "__frame__", (getter) namespace_get_frame, NULL,
+    "The frame whose variables this namespace exposes", NULL },
+
+  { NULL, NULL, NULL, NULL, NULL },
+};
+
+
+#define NAMESPACE_NAME "livelocals._frame.FrameNamespace"
+#define NAMESPACE_FLAGS \
+  (Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_GC)
+#define NAMESPACE_DOC \
+  "Attribute-style view of a frame's variables. Subclassed per" \
+  " code object with a SlotVar for each variable."
+
+
+/**
+   A SlotVar is a data descriptor bound to the index of a fast, cell,
+   or free variable. When accessed from a FrameNamespace instance, it
+   reads, assigns, or clears that variable in the namespace's frame.
+
+   Each SlotVar keeps a reference to the module which created it, for
+   access to that module's state.
+ */
+typedef struct {
+  PyObject_HEAD
+  PyObject *module;
+  PyObject *name;
+  int index;
+  int cell;
+} SlotVar;
+
+
+static PyObject *slotvar_new(PyTypeObject *type,
+			     PyObject *args, PyObject *kwds) {
+  PyErr_SetString(PyExc_TypeError,
+		  "SlotVar instances are created by _frame.slotvar()");
+  return NULL;
+}
+
+
+static void slotvar_dealloc(SlotVar *self) {
+  PyTypeObject *type = Py_TYPE(self);
+
+  Py_CLEAR(self->module);
+  Py_CLEAR(self->name);
+  type->tp_free((PyObject *) self);
+
+#if PY_VERSION_HEX >= 0x03080000
+  Py_DECREF(type);
+#endif
+}
+
+
+static PyObject *slotvar_repr(SlotVar *self) {
+#if PY_MAJOR_VERSION >= 3
+  return PyUnicode_FromFormat("<%s variable %R at index %i>",
+			      self->cell? "cell": "fast",
+			      self->name, self->index);
+#else
+  PyObject *name = PyObject_Repr(self->name);
+  PyObject *result = NULL;
+
+  if (name) {
+    result = PyString_FromFormat("<%s variable %s at index %i>",
+				 self->cell? "cell": "fast",
+				 PyString_AsString(name), self->index);
+    Py_DECREF(name);
+  }
+  return result;
+#endif
+}
+
+
+/**
+   Returns a borrowed reference to the frame of a FrameNamespace, after
+   checking that the descriptor's index is valid for it. Otherwise
+   sets an exception and returns NULL.
+ */
+static PyFrameObject *slotvar_frame(module_state *st,
+				    SlotVar *self, PyObject *obj) {
+  PyFrameObject *frame = NULL;
+
+  if (! PyObject_TypeCheck(obj, st->namespace_type)) {
+    PyErr_Format(PyExc_TypeError,
+		 "descriptor requires a FrameNamespace, not '%.200s'",
+		 Py_TYPE(obj)->tp_name);
+    return NULL;
+  }
+
+  frame = ((FrameNamespace *) obj)->frame;
+  if (! frame) {
+    PyErr_SetString(PyExc_ValueError, "namespace has no frame");
+    return NULL;
+  }
+
+  if (self->cell) {
+    if (! valid_cell_index(st, frame->f_code, self->index))
+      return NULL;
+  } else {
+    if (! valid_fast_index(st, frame->f_code, self->index))
+      return NULL;
+  }
+
+  return frame;
+}
+
+
+static PyObject *slotvar_get(SlotVar *self, PyObject *obj, PyObject *type) {
+  module_state *st = NULL;
+  PyFrameObject *frame = NULL;
+  PyObject *result = NULL;
+
+  if (! obj) {
+    Py_INCREF(self);
+    return (PyObject *) self;
+  }
+
+  st = get_state(self->module);
+  COUNT(st, STAT_SLOTVAR_GET);
+
+  frame = slotvar_frame(st, self, obj);
+  if (! frame)
+    return NULL;
+
+  if (self->cell)
+    result = cell_get(frame, self->index);
+  else
+    result = fast_get(frame, self->index);
+
+  if (! result)
+    name_error(st, frame->f_code, self->index);
+
+  return result;
+}
+
+
+static int slotvar_set(SlotVar *self, PyObject *obj, PyObject *value) {
+  module_state *st = get_state(self->module);
+  PyFrameObject *frame = NULL;
+
+  COUNT(st, STAT_SLOTVAR_SET);
+
+  frame = slotvar_frame(st, self, obj);
+  if (! frame)
+    return -1;
+
+  if (self->cell)
+    return cell_set(st, frame, self->index, value);
+  else
+    return fast_set(st, frame, self->index, value);
+}
+
+
+static PyMemberDef slotvar_members[] = {
+  { "__name__", T_OBJECT, offsetof(SlotVar, name), READONLY,
+    "Name of the variable" },
+
+  { "index", T_INT, offsetof(SlotVar, index), READONLY,
+    "Index of the variable in the frame" },
+
+  { "cell", T_INT, offsetof(SlotVar, cell), READONLY,
+    "True if the variable is a cell or free variable" },
+
+  { NULL, 0, 0, 0, NULL },
+};
+
+
+#define SLOTVAR_NAME "livelocals._frame.SlotVar"
+#define SLOTVAR_FLAGS Py_TPFLAGS_DEFAULT
+#define SLOTVAR_DOC \
+  "Data descriptor for a variable of a FrameNamespace's frame"
+
+
+#if PY_MAJOR_VERSION >= 3
+/* Python 3 uses heap types, so that each interpreter has its own */
+
+
+static PyType_Slot namespace_slots[] = {
+  { Py_tp_doc, NAMESPACE_DOC },
+  { Py_tp_new, namespace_new },
+  { Py_tp_dealloc, namespace_dealloc },
+  { Py_tp_traverse, namespace_traverse },
+  { Py_tp_clear, namespace_clear },
+  { Py_tp_repr, namespace_repr },
+  { Py_tp_getset, namespace_getset },
+  { 0, NULL },
+};
+
+
+static PyType_Spec namespace_spec = {
+  NAMESPACE_NAME,
+  sizeof(FrameNamespace),
+  0,
+  NAMESPACE_FLAGS,
+  namespace_slots,
+};
+
+
+static PyType_Slot slotvar_slots[] = {
+  { Py_tp_doc, SLOTVAR_DOC },
+  { Py_tp_new, slotvar_new },
+  { Py_tp_dealloc, slotvar_dealloc },
+  { Py_tp_repr, slotvar_repr },
+  { Py_tp_members, slotvar_members },
+  { Py_tp_descr_get, slotvar_get },
+  { Py_tp_descr_set, slotvar_set },
+  { 0, NULL },
+};
+
+
+static PyType_Spec slotvar_spec = {
+  SLOTVAR_NAME,
+  sizeof(SlotVar),
+  0,
+  SLOTVAR_FLAGS,
+  slotvar_slots,
+};
+
+
+#else
+/* Python 2 uses static types */
+
+
+static PyTypeObject FrameNamespaceType = {
+  PyVarObject_HEAD_INIT(NULL, 0)
+
+  .tp_name = NAMESPACE_NAME,
+  .tp_basicsize = sizeof(FrameNamespace),
+  .tp_flags = NAMESPACE_FLAGS,
+  .tp_doc = NAMESPACE_DOC,
+
+  .tp_new = namespace_new,
+  .tp_dealloc = (destructor) namespace_dealloc,
+  .tp_traverse = (traverseproc) namespace_traverse,
+  .tp_clear = (inquiry) namespace_clear,
+  .tp_repr = (reprfunc) namespace_repr,
+  .tp_getset = namespace_getset,
+};
+
+
+static PyTypeObject SlotVarType = {
+  PyVarObject_HEAD_INIT(NULL, 0)
+
+  .tp_name = SLOTVAR_NAME,
+  .tp_basicsize = sizeof(SlotVar),
+  .tp_flags = SLOTVAR_FLAGS,
+  .tp_doc = SLOTVAR_DOC,
+
+  .tp_new = slotvar_new,
+  .tp_dealloc = (destructor) slotvar_dealloc,
+  .tp_repr = (reprfunc) slotvar_repr,
+  .tp_members = slotvar_members,
+  .tp_descr_get = (descrgetfunc) slotvar_get,
+  .tp_descr_set = (descrsetfunc) slotvar_set,
+};
+
+
+#endif
+
+
+/**
+   Creates a SlotVar descriptor for the variable at the given index.
+
+   From Python:
+   descriptor = _frame.slotvar(name, index, cell=False)
+ */
+static PyObject *new_slotvar(PyObject *self, PyObject *args) {
+  module_state *st = get_state(self);
+  PyObject *name = NULL;
+  int index = -1;
+  int cell = 0;
+  SlotVar *var = NULL;
+
+  if (! PARSE_ARGS(args, "Oi|i", &name, &index, &cell))
+    return NULL;
+
+  var = PyObject_New(SlotVar, st->slotvar_type);
+  if (! var)
+    return NULL;
+
+  /* Python 2 passes no module to its functions, but has only the
+     one static state, so there is nothing to keep alive. */
+  Py_XINCREF(self);
+  var->module = self;
+  Py_INCREF(name);
+  var->name = name;
+  var->index = index;
+  var->cell = cell;
+
+  return (PyObject *) var;
+}
+
+
+/**
+   Enables or disables instrumentation of the accessors.
+
+   From Python:
+   _frame.set_hooks(stats=False, callback=None, audit=False)
+ */
+static PyObject *set_hooks(PyObject *self, PyObject *args, PyObject *kwds) {
+  static char *keywords[] = { "stats", "callback", "audit", NULL };
+
+  module_state *st = get_state(self);
+  int want_stats = 0;
+  PyObject *callback = Py_None;
+  PyObject *old = NULL;
+  int want_audit = 0;
+  int flags = 0;
+
+  if (! PyArg_ParseTupleAndKeywords(args, kwds, "|iOi", keywords,
+				    &want_stats, &callback, &want_audit))
+    return NULL;
+
+  if (callback != Py_None && ! PyCallable_Check(callback)) {
+    PyErr_SetString(PyExc_TypeError, "callback must be callable or None");
+    return NULL;
+  }
+
+#if PY_VERSION_HEX < 0x03080000
+  if (want_audit) {
+    PyErr_SetString(PyExc_NotImplementedError,
+		    "audit events require Python 3.8 or later");
+    return NULL;
+  }
+#endif
+
+  if (want_stats)
+    flags |= HOOK_STATS;
+  if (callback != Py_None)
+    flags |= HOOK_CALLBACK;
+  if (want_audit)
+    flags |= HOOK_AUDIT;
+
+  if (callback == Py_None)
+    callback = NULL;
+  Py_XINCREF(callback);
+
+  LOCK_HOOKS(st);
+  old = st->write_callback;
+  st->write_callback = callback;
+  st->hook_flags = flags;
+  UNLOCK_HOOKS(st);
+
+  Py_XDECREF(old);
+
+  Py_RETURN_NONE;
+}
+
+
+/**
+   Returns a dict of the counters collected while stats are enabled.
+
+   From Python:
+   counts = _frame.stats()
+ */
+static PyObject *get_stats(PyObject *self, PyObject *args) {
+  module_state *st = get_state(self);
+  PyObject *result = PyDict_New();
+  PyObject *count = NULL;
+  int index;
+
+  if (! result)
+    return NULL;
+
+  for (index = 0; index < STAT_COUNT; index++) {
+    count = PyLong_FromUnsignedLongLong(st->stats[index]);
+    if (! count || PyDict_SetItemString(result, stat_names[index], count)) {
+      Py_XDECREF(count);
+      Py_DECREF(result);
+      return NULL;
+    }
+    Py_DECREF(count);
+  }
+
+  return result;
+}
+
+
+/**
+   Resets all of the counters to zero.
+
+   From Python:
+   _frame.reset_stats()
+ */
+static PyObject *reset_stats(PyObject *self, PyObject *args) {
+  module_state *st = get_state(self);
+
+  memset(st->stats, 0, sizeof(st->stats));
+  Py_RETURN_NONE;
+}
+
+
+static PyMethodDef methods[] = {
+  { "frame_get_fast",
+    (PyCFunction) frame_get_fast, METH_VARARGS,
+    "Get the value of a fast variable in a frame. Raises a ValueError"
+    " if the index is out of range. Raises a NameError if the variable"
+    " is not currently defined."},
+
+  { "frame_set_fast",
+    (PyCFunction) frame_set_fast, METH_VARARGS,
+    "Set the value of a fast variable in a frame. Raises a ValueError"
+    " if the index is out of range." },
+
+  { "frame_del_fast",
+    (PyCFunction) frame_del_fast, METH_VARARGS,
+    "Clear the value of a fast variable in a frame, marking it as"
+    " undefined until a new value is set. Raises a ValueError if the"
+    " index is out of range." },
+
+  { "frame_get_cell",
+    (PyCFunction) frame_get_cell, METH_VARARGS,
+    "Get the value of a cell or free variable in a frame. Raises a"
+    " ValueError if the index is out of range. Raises a NameError if"
+    " the variable is not currently defined." },
+
+  { "frame_set_cell",
+    (PyCFunction) frame_set_cell, METH_VARARGS,
+    "Set the value of a cell or free variable in a frame. Raises a"
+    " ValueError if the index is out of range." },
+
+  { "frame_del_cell",
+    (PyCFunction) frame_del_cell, METH_VARARGS,
+    "Clear the value of a cell or free variable in a frame, marking"
+    " it as undefined until a new value is set. Raises a ValueError if"
+    " the index is out of range." },
+
+  { "frame_apply",
+    (PyCFunction) frame_apply, METH_VARARGS,
+    "Apply a tuple of (index, value) writes to the variables of a"
+    " frame all at once, clearing those whose value is the given"
+    " unbound marker. Nothing is applied if any index is invalid." },
+
+  { "frame_values",
+    (PyCFunction) frame_values, METH_VARARGS,
+    "Get a tuple of the values of a frame's fast, cell, and free"
+    " variables, in slot order, using the given value for unbound"
+    " variables. If a tuple subtype is given, the result is an"
+    " instance of it." },
+
+  { "frame_diff",
+    (PyCFunction) frame_diff, METH_VARARGS,
+    "Compare the values of a frame's fast, cell, and free variables"
+    " by identity against a list of previous values, updating the list"
+    " and returning a tuple of the (index, value) pairs which changed." },
+
+  { "frame_get_locals",
+    (PyCFunction) frame_get_locals, METH_VARARGS,
+    "Get the mapping holding the variables of a frame whose code isn't"
+    " optimized, without merging in its fast or cell variables. Returns"
+    " None if the frame has no such mapping." },
+
+  { "closure_get",
+    (PyCFunction) closure_get, METH_VARARGS,
+    "Get the value of a free variable in a function's closure. Raises"
+    " a ValueError if the index is out of range. Raises a NameError if"
+    " the variable is not currently defined."},
+
+  { "closure_set",
+    (PyCFunction) closure_set, METH_VARARGS,
+    "Set the value of a free variable in a function's closure. Raises"
+    " a ValueError if the index is out of range." },
+
+  { "closure_del",
+    (PyCFunction) closure_del, METH_VARARGS,
+    "Clear the value of a free variable in a function's closure,"
+    " marking it as undefined until a new value is set. Raises a"
+    " ValueError if the index is out of range." },
+
+  { "closure_rebind",
+    (PyCFunction) closure_rebind, METH_VARARGS,
+    "Set the free variable with the given name to value in each of an"
+    " iterable of functions, and return how many were set. Nothing is"
+    " set if any isn't a function with such a free variable." },
+
+  { "slotvar",
+    (PyCFunction) new_slotvar, METH_VARARGS,
+    "slotvar(name, index, cell=False) -- Create a SlotVar descriptor"
+    " for the fast (or if cell is true, the cell or free) variable at"
+    " index." },
+
+  { "set_hooks",
+    (PyCFunction) set_hooks, METH_VARARGS | METH_KEYWORDS,
+    "set_hooks(stats=False, callback=None, audit=False) -- Enable"
+    " instrumentation of the accessors. If stats is true, call and"
+    " error counters are collected. If callback is given, it is called"
+    " with (frame, name, old, new) after each write, with None for an"
+    " unbound value. If audit is true, a livelocals.write audit event"
+    " is raised with the same arguments. Calling with no arguments"
+    " disables all instrumentation." },
+
+  { "stats",
+    (PyCFunction) get_stats, METH_NOARGS,
+    "Returns a dict of the counters collected while stats are"
+    " enabled." },
+
+  { "reset_stats",
+    (PyCFunction) reset_stats, METH_NOARGS,
+    "Resets all of the counters to zero." },
+
+  { NULL, NULL, 0, NULL },
+};
+
+
+/**
+   Creates the types for this module's state, and adds them to the
+   module. Returns 0 on success, or -1 with an exception set.
+ */
+static int module_exec(PyObject *mod) {
+  module_state *st = get_state(mod);
+
+#if PY_MAJOR_VERSION >= 3
+  st->namespace_type = (PyTypeObject *) PyType_FromSpec(&namespace_spec);
+  if (! st->namespace_type)
+    return -1;
+
+  st->slotvar_type = (PyTypeObject *) PyType_FromSpec(&slotvar_spec);
+  if (! st->slotvar_type)
+    return -1;
+
+#else
+  if (PyType_Ready(&FrameNamespaceType) < 0 ||
+      PyType_Ready(&SlotVarType) < 0)
+    return -1;
+
+  Py_INCREF(&FrameNamespaceType);
+  st->namespace_type = &FrameNamespaceType;
+
+  Py_INCREF(&SlotVarType);
+  st->slotvar_type = &SlotVarType;
+#endif
+
+  Py_INCREF(st->namespace_type);
+  if (PyModule_AddObject(mod, "FrameNamespace",
+			 (PyObject *) st->namespace_type) < 0) {
+    Py_DECREF(st->namespace_type);
+    return -1;
+  }
+
+  Py_INCREF(st->slotvar_type);
+  if (PyModule_AddObject(mod, "SlotVar",
+			 (PyObject *) st->slotvar_type) < 0) {
+    Py_DECREF(st->slotvar_type);
+    return -1;
+  }
+
+  return 0;
+}
+
+
+#if PY_MAJOR_VERSION >= 3
+/* Python 3 Mode */
+
+
+static int module_traverse(PyObject *mod, visitproc visit, void *arg) {
+  module_state *st = get_state(mod);
+
+  Py_VISIT(st->write_callback);
+  Py_VISIT(st->namespace_type);
+  Py_VISIT(st->slotvar_type);
+  return 0;
+}
+
+
+static int module_clear(PyObject *mod) {
+  module_state *st = get_state(mod);
+
+  st->hook_flags = 0;
+  Py_CLEAR(st->write_callback);
+  Py_CLEAR(st->namespace_type);
+  Py_CLEAR(st->slotvar_type);
+  return 0;
+}
+
+
+static void module_free(void *mod) {
+  module_clear((PyObject *) mod);
+}
+
+
+#if PY_VERSION_HEX >= 0x03050000
+static PyModuleDef_Slot module_slots[] = {
+  { Py_mod_exec, module_exec },
+#if PY_VERSION_HEX >= 0x030C0000
+  { Py_mod_multiple_interpreters, Py_MOD_PER_INTERPRETER_GIL_SUPPORTED },
+#endif
+#ifdef Py_GIL_DISABLED
+  { Py_mod_gil, Py_MOD_GIL_NOT_USED },
+#endif
+  { 0, NULL },
+};
+#endif
+
+
+static struct PyModuleDef moduledef = {
+  PyModuleDef_HEAD_INIT,
+  .m_name = "livelocals._frame",
+  .m_doc = NULL,
+  .m_size = sizeof(module_state),
+  .m_methods = methods,
+#if PY_VERSION_HEX >= 0x03050000
+  .m_slots = module_slots,
+#endif
+  .m_traverse = module_traverse,
+  .m_clear = module_clear,
+  .m_free = module_free,
+};
+
+
+PyMODINIT_FUNC PyInit__frame(void) {
+#if PY_VERSION_HEX >= 0x03050000
+  /* multi-phase init, see PEP 489 */
+  return PyModuleDef_Init(&moduledef);
+
+#else
+  PyObject *mod = PyModule_Create(&moduledef);
+
+  if (mod && module_exec(mod) < 0)
+    Py_CLEAR(mod);
+
+  return mod;
+#endif
+}
+
+
+#else
+/* Python 2 Mode */
+
 
+PyMODINIT_FUNC init_frame(void) {
+  PyObject *mod = Py_InitModule("livelocals._frame", methods);
 
-PyMODINIT_FUNC init_frame() {
-  Py_InitModule("livelocals._frame", methods);
+  if (mod)
+    module_exec(mod);
 }
 
 #endif
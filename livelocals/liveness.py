@@ -0,0 +1,245 @@
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+livelocals.liveness
+
+Bytecode analysis of which fast variables a code object may still
+read at each instruction.
+
+The analysis is conservative. A variable is only considered dead if no
+path through the code, including exception handlers, can read it
+before it is next assigned or deleted. Cell and free variables may be
+read by other scopes at any time, so they are always considered live.
+
+author: Christopher O'Brien  <obriencj@gmail.com>
+license: LGPL v.3
+"""
+
+
+from dis import hasjabs, hasjrel
+from weakref import WeakKeyDictionary
+
+try:
+    from dis import get_instructions
+except ImportError:
+    # Python 2 has no instruction iterator, so liveness is unknown
+    get_instructions = None
+
+
+__all__ = ("liveness", "live_names", )
+
+
+# instructions which read a fast variable
+_USES = frozenset((
+    "LOAD_FAST", "LOAD_FAST_CHECK", "LOAD_FAST_AND_CLEAR",
+))
+
+# instructions which assign or clear a fast variable
+_DEFS = frozenset((
+    "STORE_FAST", "DELETE_FAST",
+))
+
+# instructions which never continue to the next instruction
+_STOPS = frozenset((
+    "RETURN_VALUE", "RETURN_CONST", "RAISE_VARARGS", "RERAISE",
+    "JUMP_ABSOLUTE", "JUMP_FORWARD", "JUMP_BACKWARD",
+    "JUMP_BACKWARD_NO_INTERRUPT", "JUMP", "CONTINUE_LOOP",
+    "BREAK_LOOP",
+))
+
+# instructions which push an exception handler covering every
+# instruction from themselves up to their target
+_HANDLERS = frozenset((
+    "SETUP_EXCEPT", "SETUP_FINALLY", "SETUP_WITH", "SETUP_ASYNC_WITH",
+))
+
+# instructions which may resume at a location recorded by the block
+# stack, rather than at their own jump target
+_RESUMES = frozenset((
+    "END_FINALLY", "WITH_CLEANUP_FINISH", "POP_FINALLY",
+))
+
+# builtins which can read every local of the calling frame
+_INTROSPECTS = frozenset((
+    "locals", "vars", "eval", "exec", "dir",
+))
+
+
+_cache = WeakKeyDictionary()
+
+
+def _exception_entries(code):
+    """
+    On versions using an exception table, returns a list of (start,
+    end, target) tuples for its entries. Otherwise an empty list.
+    """
+
+    try:
+        from dis import Bytecode
+        entries = Bytecode(code).exception_entries
+    except (ImportError, AttributeError):
+        return []
+
+    return [(e.start, e.end, e.target) for e in entries]
+
+
+def _successors(code, instrs, position):
+    """
+    Returns a list of sets, holding the positions of the instructions
+    which may follow each instruction. Where the exact successor
+    depends on runtime state, every candidate is included.
+    """
+
+    jumps = frozenset(hasjabs) | frozenset(hasjrel)
+
+    offsets = [i.offset for i in instrs]
+    handlers = _exception_entries(code)
+    loops = []
+    resumes = set()
+
+    for n, instr in enumerate(instrs):
+        name = instr.opname
+        if name in _HANDLERS:
+            handlers.append((instr.offset, instr.argval, instr.argval))
+        elif name == "SETUP_LOOP":
+            loops.append((instr.offset, instr.argval))
+            resumes.add(instr.argval)
+        elif name == "CONTINUE_LOOP":
+            resumes.add(instr.argval)
+        elif name == "CALL_FINALLY" and n + 1 < len(instrs):
+            resumes.add(offsets[n + 1])
+
+    resumes = [position[o] for o in resumes if o in position]
+
+    found = []
+    for n, instr in enumerate(instrs):
+        name = instr.opname
+        succ = set()
+
+        if name not in _STOPS and n + 1 < len(instrs):
+            succ.add(n + 1)
+
+        if instr.opcode in jumps and instr.argval in position:
+            succ.add(position[instr.argval])
+
+        if name == "BREAK_LOOP":
+            succ.update(position[end] for start, end in loops
+                        if start < instr.offset < end and end in position)
+
+        elif name in _RESUMES:
+            succ.update(resumes)
+
+        succ.update(position[target] for start, end, target in handlers
+                    if start <= instr.offset < end and target in position)
+
+        found.append(succ)
+
+    return found
+
+
+def _analyze(code):
+    """
+    Returns a dict mapping each instruction offset in code to a
+    frozenset of the fast variable names that are live after that
+    instruction executes.
+    """
+
+    instrs = list(get_instructions(code))
+    if not instrs:
+        return {}
+
+    offsets = [i.offset for i in instrs]
+
+    if _INTROSPECTS.intersection(code.co_names):
+        everything = frozenset(code.co_varnames)
+        found = dict.fromkeys(offsets, everything)
+        found[-1] = everything
+        return found
+
+    position = dict((o, n) for n, o in enumerate(offsets))
+    succs = _successors(code, instrs, position)
+
+    uses = [i.argval if i.opname in _USES else None for i in instrs]
+    defs = [i.argval if i.opname in _DEFS else None for i in instrs]
+
+    empty = frozenset()
+    live_in = [empty] * len(instrs)
+    live_out = [empty] * len(instrs)
+
+    changed = True
+    while changed:
+        changed = False
+        for n in range(len(instrs) - 1, -1, -1):
+            out = set()
+            for s in succs[n]:
+                out.update(live_in[s])
+
+            result = set(out)
+            if defs[n] is not None:
+                result.discard(defs[n])
+            if uses[n] is not None:
+                result.add(uses[n])
+
+            if result != live_in[n] or out != live_out[n]:
+                live_in[n] = frozenset(result)
+                live_out[n] = frozenset(out)
+                changed = True
+
+    found = dict(zip(offsets, live_out))
+
+    # a frame which has not yet started reports an f_lasti of -1
+    found[-1] = live_in[0]
+
+    return found
+
+
+def liveness(code, _cache=_cache):
+    """
+    Returns a dict mapping each instruction offset of a code object to
+    a frozenset of the names of fast variables which may still be read
+    after that instruction executes. The offset -1 maps to the
+    variables live on entry. Results are cached per code object.
+
+    Returns None if bytecode analysis is not supported by this version
+    of Python.
+    """
+
+    if get_instructions is None:
+        return None
+
+    found = _cache.get(code, None)
+    if found is None:
+        found = _cache[code] = _analyze(code)
+
+    return found
+
+
+def live_names(frame):
+    """
+    Returns a frozenset of the fast variable names of a frame which
+    may still be read, based on the frame's last executed instruction.
+    Returns None if this isn't known.
+    """
+
+    found = liveness(frame.f_code)
+    if found is None:
+        return None
+
+    return found.get(frame.f_lasti, None)
+
+
+#
+# The end.
@@ -0,0 +1,153 @@
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+livelocals.report
+
+Bounded capture of the local variables of a traceback's frames, for
+error reporting.
+
+author: Christopher O'Brien  <obriencj@gmail.com>
+license: LGPL v.3
+"""
+
+
+from collections import namedtuple
+from sys import maxsize
+
+try:
+    from reprlib import Repr
+except ImportError:
+    # Python 2
+    from repr import Repr
+
+from livelocals import UNBOUND
+from livelocals._frame import frame_values
+
+
+__all__ = ("CapturedFrame", "capture_traceback", )
+
+
+# The location of one frame of a traceback, and the reprs of as many
+# of its variables as fit within the budgets. truncated is True if any
+# of its variables were omitted.
+CapturedFrame = namedtuple("CapturedFrame", ("filename", "lineno", "name",
+                                             "locals", "truncated", ))
+
+
+def _repr_size(text):
+    if isinstance(text, bytes):
+        return len(text)
+    else:
+        return len(text.encode("utf8", "replace"))
+
+
+def _make_repr(max_repr_len):
+    """
+    A Repr which gives up on containers after a few items and levels,
+    and abbreviates long strings as it builds them, so that the cost
+    of each repr is bounded well before max_repr_len is applied.
+    """
+
+    found = Repr()
+    found.maxlevel = 3
+    found.maxstring = max_repr_len
+    found.maxother = max_repr_len
+    found.maxlong = max_repr_len
+    return found
+
+
+def capture_traceback(tb, max_frames=20, max_vars=50, max_repr_len=200,
+                      max_total_bytes=65536):
+    """
+    Returns a list of CapturedFrame for the innermost max_frames frames
+    of a traceback, ordered from outermost to innermost as in the
+    traceback itself.
+
+    The values of each frame's fast, cell, and free variables are read
+    in a single native call, and the reprs of at most max_vars of them
+    are captured, each abbreviated to at most max_repr_len characters.
+    Frames are captured innermost first, and once the reprs and names
+    captured total max_total_bytes (as UTF-8), no further variables are
+    read from that frame or any frame further out. Such frames are
+    marked as truncated.
+
+    Any of the budgets may be None, in which case it is unlimited.
+
+    The variables of module and class body frames are not captured.
+    """
+
+    frames = []
+    while tb is not None:
+        frames.append((tb.tb_frame, tb.tb_lineno))
+        tb = tb.tb_next
+
+    if max_frames is not None:
+        frames = frames[max(0, len(frames) - max_frames):]
+
+    if max_vars is None:
+        max_vars = maxsize
+    if max_repr_len is None:
+        max_repr_len = maxsize
+    if max_total_bytes is None:
+        max_total_bytes = maxsize
+
+    short = _make_repr(max_repr_len)
+    remaining = max_total_bytes
+
+    found = []
+    for frame, lineno in reversed(frames):
+        code = frame.f_code
+        captured = {}
+        truncated = False
+
+        if remaining > 0:
+            names = code.co_varnames + code.co_cellvars + code.co_freevars
+            values = frame_values(frame, UNBOUND)
+
+            for name, value in zip(names, values):
+                if value is UNBOUND:
+                    continue
+
+                if len(captured) >= max_vars:
+                    truncated = True
+                    break
+
+                try:
+                    text = short.repr(value)
+                except Exception as err:
+                    text = "<repr failed: %s>" % type(err).__name__
+
+                text = text[:max_repr_len]
+                remaining -= _repr_size(name) + _repr_size(text)
+
+                if remaining < 0:
+                    truncated = True
+                    break
+
+                captured[name] = text
+
+        else:
+            truncated = True
+
+        found.append(CapturedFrame(code.co_filename, lineno, code.co_name,
+                                   captured, truncated))
+
+    found.reverse()
+    return found
+
+
+#
+# The end.
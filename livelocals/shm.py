@@ -0,0 +1,373 @@
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+livelocals.shm
+
+Export selected local variables of a frame into a shared memory
+segment, where another process may poll them without any IPC.
+
+The segment begins with a fixed header, followed by one fixed-size
+record per exported variable. Integers, floats, booleans, and None are
+stored in binary. Any other value is stored as a bounded repr. Each
+update is guarded by a seqlock-style version counter, which is odd
+while an update is being written.
+
+Requires Python 3.8 or later.
+
+author: Christopher O'Brien  <obriencj@gmail.com>
+license: LGPL v.3
+"""
+
+
+import reprlib
+
+from multiprocessing.shared_memory import SharedMemory
+from struct import Struct
+from threading import Event, Thread
+
+from livelocals import _layout, _unbound
+
+
+__all__ = ("LocalsExporter", "LocalsReader", )
+
+
+_MAGIC = b"LLSM"
+_FORMAT = 1
+
+# magic, format, version, count, name size, repr size
+_HEADER = Struct("<4sIQIII4x")
+
+# the version counter alone, for polling
+_VERSION = Struct("<Q")
+_VERSION_OFFSET = 8
+
+# tag, repr length, then eight bytes of binary value
+_RECORD = Struct("<BxxxI")
+_INT = Struct("<q")
+_FLOAT = Struct("<d")
+
+_UNBOUND, _NONE, _BOOL, _INT_TAG, _FLOAT_TAG, _REPR = range(6)
+
+_INT_MIN = -(1 << 63)
+_INT_MAX = (1 << 63) - 1
+
+
+def _record_size(name_size, repr_size):
+    size = name_size + _RECORD.size + 8 + repr_size
+    return (size + 7) & ~7
+
+
+class LocalsExporter(object):
+    """
+    Copies the named local variables of a frame into a new shared
+    memory segment, either when `update()` is called or periodically
+    from a background thread via `start()`.
+
+    The exporter holds a reference to the frame until `close()` is
+    called, and unlinks the segment at that time.
+    """
+
+    def __init__(self, frame, names, name=None,
+                 name_size=64, repr_size=256):
+        """
+        Resolves names against the frame's code, and creates the shared
+        memory segment. Raises a KeyError if a name is not a declared
+        variable of the frame. If name is None, the segment is given a
+        random name, available as the `name` attribute.
+        """
+
+        layout = _layout(frame.f_code)
+        self._vars = [layout[n][:2] for n in names]
+        self._frame = frame
+
+        self._name_size = name_size
+        self._repr_size = repr_size
+        self._record_size = _record_size(name_size, repr_size)
+
+        self._repr = reprlib.Repr()
+        self._repr.maxstring = repr_size
+        self._repr.maxother = repr_size
+
+        size = _HEADER.size + self._record_size * len(self._vars)
+        self._shm = SharedMemory(name=name, create=True, size=size)
+        self._version = 0
+
+        buf = self._shm.buf
+        _HEADER.pack_into(buf, 0, _MAGIC, _FORMAT, 0, len(names),
+                          name_size, repr_size)
+
+        offset = _HEADER.size
+        for n in names:
+            encoded = n.encode("utf8")[:name_size]
+            buf[offset:offset + len(encoded)] = encoded
+            offset += self._record_size
+
+        self._thread = None
+        self._stopping = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, _tb_type, _tb_value, _tb_traceback):
+        self.close()
+
+
+    @property
+    def name(self):
+        """
+        The name of the shared memory segment.
+        """
+
+        return self._shm.name
+
+
+    def update(self):
+        """
+        Copies the current values of the exported variables into the
+        shared memory segment.
+        """
+
+        frame = self._frame
+        buf = self._shm.buf
+        size = self._record_size
+        value_offset = self._name_size + _RECORD.size
+        repr_size = self._repr_size
+
+        self._version += 1
+        _VERSION.pack_into(buf, _VERSION_OFFSET, self._version)
+
+        offset = _HEADER.size
+        for index, getter in self._vars:
+            value = getter(frame, index, _unbound)
+            vtype = type(value)
+            length = 0
+
+            if value is _unbound:
+                tag = _UNBOUND
+            elif value is None:
+                tag = _NONE
+            elif vtype is bool:
+                tag = _BOOL
+                _INT.pack_into(buf, offset + value_offset, value)
+            elif vtype is int and _INT_MIN <= value <= _INT_MAX:
+                tag = _INT_TAG
+                _INT.pack_into(buf, offset + value_offset, value)
+            elif vtype is float:
+                tag = _FLOAT_TAG
+                _FLOAT.pack_into(buf, offset + value_offset, value)
+            else:
+                tag = _REPR
+                encoded = self._repr.repr(value).encode("utf8")
+                encoded = encoded[:repr_size]
+                length = len(encoded)
+                start = offset + value_offset + 8
+                buf[start:start + length] = encoded
+
+            _RECORD.pack_into(buf, offset + self._name_size, tag, length)
+            offset += size
+
+        self._version += 1
+        _VERSION.pack_into(buf, _VERSION_OFFSET, self._version)
+
+
+    def start(self, interval=0.1):
+        """
+        Starts a daemon thread which calls `update()` every interval
+        seconds, until `stop()` or `close()` is called.
+        """
+
+        if self._thread is not None:
+            return
+
+        self._stopping = stopping = Event()
+
+        def run():
+            while not stopping.is_set():
+                self.update()
+                stopping.wait(interval)
+
+        self._thread = Thread(target=run, name="livelocals-export")
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def stop(self):
+        """
+        Stops the background thread, if one is running.
+        """
+
+        if self._thread is None:
+            return
+
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+        self._stopping = None
+
+
+    def close(self):
+        """
+        Stops any background thread, releases the frame, and closes and
+        unlinks the shared memory segment.
+        """
+
+        self.stop()
+        self._frame = None
+        self._vars = []
+
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+
+class LocalsReader(object):
+    """
+    Attaches to a segment created by a LocalsExporter, possibly in
+    another process, and decodes its values directly from the shared
+    buffer.
+    """
+
+    def __init__(self, name, untrack=True):
+        """
+        Attaches to the named segment. If untrack is True, the segment is
+        removed from this process's resource tracker, so that it won't
+        be unlinked when this process exits. This should be False when
+        the exporter is in the same process.
+        """
+
+        shm = SharedMemory(name=name)
+        if untrack:
+            _untrack(shm)
+
+        self._shm = shm
+        buf = shm.buf
+
+        magic, fmt, _version, count, name_size, repr_size = \
+            _HEADER.unpack_from(buf, 0)
+
+        if magic != _MAGIC or fmt != _FORMAT:
+            shm.close()
+            raise ValueError("%r is not a livelocals export" % name)
+
+        self._name_size = name_size
+        self._repr_size = repr_size
+        self._record_size = size = _record_size(name_size, repr_size)
+
+        names = []
+        offset = _HEADER.size
+        for _i in range(count):
+            raw = bytes(buf[offset:offset + name_size])
+            names.append(raw.rstrip(b"\0").decode("utf8", "replace"))
+            offset += size
+
+        self.names = tuple(names)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, _tb_type, _tb_value, _tb_traceback):
+        self.close()
+
+
+    @property
+    def version(self):
+        """
+        The current version counter of the segment. This is odd while an
+        update is in progress, and grows by two with each update, so
+        polling it is a cheap way to check for new values.
+        """
+
+        return _VERSION.unpack_from(self._shm.buf, _VERSION_OFFSET)[0]
+
+
+    def read(self, retries=10000):
+        """
+        Returns a tuple of the version and a dict of the exported
+        variables which were bound as of that version. Values other than
+        numbers, booleans, and None are returned as their repr strings.
+
+        If a consistent copy can't be read within the given number of
+        retries, raises a RuntimeError.
+        """
+
+        buf = self._shm.buf
+        size = self._record_size
+        value_offset = self._name_size + _RECORD.size
+
+        for _i in range(retries):
+            before = _VERSION.unpack_from(buf, _VERSION_OFFSET)[0]
+            if before & 1:
+                continue
+
+            found = {}
+            offset = _HEADER.size
+            for name in self.names:
+                tag, length = _RECORD.unpack_from(buf,
+                                                  offset + self._name_size)
+                start = offset + value_offset
+
+                if tag == _NONE:
+                    found[name] = None
+                elif tag == _BOOL:
+                    found[name] = bool(_INT.unpack_from(buf, start)[0])
+                elif tag == _INT_TAG:
+                    found[name] = _INT.unpack_from(buf, start)[0]
+                elif tag == _FLOAT_TAG:
+                    found[name] = _FLOAT.unpack_from(buf, start)[0]
+                elif tag == _REPR:
+                    raw = bytes(buf[start + 8:start + 8 + length])
+                    found[name] = raw.decode("utf8", "ignore")
+
+                offset += size
+
+            after = _VERSION.unpack_from(buf, _VERSION_OFFSET)[0]
+            if before == after:
+                return before, found
+
+        raise RuntimeError("unable to read a consistent copy")
+
+
+    def close(self):
+        """
+        Detaches from the shared memory segment.
+        """
+
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+
+def _untrack(shm):
+    """
+    SharedMemory registers every attached segment with the resource
+    tracker, which unlinks it when the process exits. That would
+    destroy an exporter's segment when a reader process exits.
+    """
+
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except (ImportError, AttributeError):
+        pass
+
+
+#
+# The end.
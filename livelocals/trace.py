@@ -0,0 +1,882 @@
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""
+livelocals.trace
+
+Line-triggered hooks for altering or recording the local variables of
+running code.
+
+author: Christopher O'Brien  <obriencj@gmail.com>
+license: LGPL v.3
+"""
+
+
+import sys
+import threading
+
+from collections import deque, namedtuple
+from dis import opmap
+from itertools import count, islice
+
+from livelocals import _layout, _SUSPENDS, UNBOUND
+from livelocals._frame import frame_diff
+
+
+__all__ = ("Rule", "LocalRewriter", "LocalsRecorder", )
+
+
+# sys.monitoring (Python 3.12 and later) can enable line events for
+# individual code objects. Older versions fall back to sys.settrace
+_monitoring = getattr(sys, "monitoring", None)
+
+
+# A single rewrite. When the frame of code reaches line, the variable
+# name is assigned value. If call is True, value is instead called
+# with the frame, and the result is assigned.
+Rule = namedtuple("Rule", ("code", "line", "name", "value", "call", ))
+
+
+_YIELD_VALUE = opmap.get("YIELD_VALUE")
+_YIELD_FROM = opmap.get("YIELD_FROM")
+
+
+def _find_code(code):
+    """
+    Accepts a code object, or a function with a code object, and
+    returns the code object.
+    """
+
+    return getattr(code, "__code__", code)
+
+
+def _suspended(frame):
+    """
+    Under sys.settrace, a "return" event is also sent when a generator
+    or coroutine suspends. This checks whether the frame's last
+    instruction was a yield, in which case the frame may resume.
+    """
+
+    code = frame.f_code
+    if not code.co_flags & _SUSPENDS:
+        return False
+
+    co_code = bytearray(code.co_code)
+    lasti = frame.f_lasti
+    if not 0 <= lasti < len(co_code):
+        return False
+
+    if co_code[lasti] == _YIELD_VALUE:
+        return True
+
+    # a suspended YIELD_FROM rewinds f_lasti to the prior instruction,
+    # so that it will be repeated on resume
+    if _YIELD_FROM is None or lasti + 2 >= len(co_code):
+        return False
+
+    return co_code[lasti + 2] == _YIELD_FROM
+
+
+# sys.monitoring sets aside ids 0, 1, 2, and 5 for debuggers, coverage
+# tools, profilers, and optimizers. One of these others is used.
+_TOOL_IDS = (4, 3)
+
+
+def _use_tool_id(name):
+    """
+    Claims and returns the first free sys.monitoring tool id which
+    isn't set aside for another kind of tool.
+    """
+
+    mon = _monitoring
+
+    for tool_id in _TOOL_IDS:
+        if mon.get_tool(tool_id) is None:
+            mon.use_tool_id(tool_id, name)
+            return tool_id
+
+    raise RuntimeError("sys.monitoring tool ids %s are in use" %
+                       ", ".join(map(str, _TOOL_IDS)))
+
+
+def _thread_trace():
+    """
+    The trace function which threading installs in new threads, if any.
+    """
+
+    gettrace = getattr(threading, "gettrace", None)
+    if gettrace is not None:
+        return gettrace()
+    else:
+        return getattr(threading, "_trace_hook", None)
+
+
+class _TraceChain(object):
+    """
+    Local trace function for a frame which more than one tracer is
+    watching. Each event is passed on to every tracer, and any which
+    return None are dropped.
+    """
+
+    __slots__ = ("tracers", )
+
+
+    def __init__(self, tracers):
+        self.tracers = tracers
+
+
+    def __call__(self, frame, event, arg):
+        found = []
+        for tracer in self.tracers:
+            tracer = tracer(frame, event, arg)
+            if tracer is not None:
+                found.append(tracer)
+
+        self.tracers = found
+        return self if found else None
+
+
+def _chain(tracers):
+    """
+    Combines local trace functions, ignoring any which are None.
+    """
+
+    found = [tracer for tracer in tracers if tracer is not None]
+
+    if not found:
+        return None
+    elif len(found) == 1:
+        return found[0]
+    else:
+        return _TraceChain(found)
+
+
+def _attach(frame, tracer):
+    """
+    Adds tracer to the local trace functions of a running frame,
+    alongside any it already has.
+    """
+
+    existing = frame.f_trace
+    if isinstance(existing, _TraceChain):
+        existing.tracers.append(tracer)
+    else:
+        frame.f_trace = _chain((existing, tracer))
+
+
+class _TraceDispatcher(object):
+    """
+    The sys.settrace hook shared by every installed LocalRewriter and
+    LocalsRecorder, for versions without sys.monitoring. It is set
+    when the first of them is installed, and passes each event on to
+    the trace function which was set before it, so a debugger or
+    coverage tool keeps working alongside them. The previous trace
+    functions are restored when the last of them is uninstalled.
+    """
+
+    def __init__(self):
+        self._tools = []
+        self._previous = None
+        self._previous_thread = None
+
+
+    def add(self, tool):
+        # this hook may have been replaced or cleared since it was
+        # last set, by a debugger for example, so it is set again over
+        # whatever is there now
+        current = sys.gettrace()
+        if current != self._trace_call:
+            self._previous = current
+            sys.settrace(self._trace_call)
+
+        current = _thread_trace()
+        if current != self._thread_call:
+            self._previous_thread = current
+            threading.settrace(self._thread_call)
+
+        self._tools.append(tool)
+
+
+    def remove(self, tool):
+        self._tools.remove(tool)
+        if self._tools:
+            return
+
+        if _thread_trace() == self._thread_call:
+            threading.settrace(self._previous_thread)
+            self._previous_thread = None
+
+        # a trace function set since may be passing events on to this
+        # one, in which case it's left in place, and does nothing but
+        # pass them on in turn
+        if sys.gettrace() == self._trace_call:
+            sys.settrace(self._previous)
+            self._previous = None
+
+
+    def _trace_call(self, frame, event, arg):
+        return self._dispatch(self._previous, frame, event, arg)
+
+
+    def _thread_call(self, frame, event, arg):
+        return self._dispatch(self._previous_thread, frame, event, arg)
+
+
+    def _dispatch(self, previous, frame, event, arg):
+        found = [tool._trace_call(frame, event, arg) for tool in self._tools]
+        if previous is not None:
+            found.insert(0, previous(frame, event, arg))
+
+        return _chain(found)
+
+
+_dispatcher = _TraceDispatcher()
+
+
+class _MonitorDispatcher(object):
+    """
+    The sys.monitoring tool shared by every installed LocalRewriter and
+    LocalsRecorder, for versions which have it. A single tool id is
+    claimed while any of them are installed. Each declares the events
+    it wants for each code object, and the union of those is enabled
+    for that code. Each event is passed on to every installed tool
+    watching the code which has a handler for it, along with the frame.
+    """
+
+    def __init__(self):
+        self._tools = []
+        self._tool_id = None
+
+        # code -> list of the tools watching it
+        self._watching = {}
+
+
+    def add(self, tool):
+        if not self._tools:
+            self._install()
+
+        self._tools.append(tool)
+        self.refresh()
+
+
+    def remove(self, tool):
+        self._tools.remove(tool)
+        self.refresh()
+
+        if not self._tools:
+            self._uninstall()
+
+
+    def refresh(self):
+        """
+        Enables the events which the installed tools currently want, and
+        disables those which none of them do any longer.
+        """
+
+        mon = _monitoring
+        tool_id = self._tool_id
+
+        wanted = {}
+        watching = {}
+        global_events = 0
+
+        for tool in self._tools:
+            local_events, tool_events = tool._monitor_events()
+            global_events |= tool_events
+
+            for code, events in local_events.items():
+                wanted[code] = wanted.get(code, 0) | events
+                watching.setdefault(code, []).append(tool)
+
+        for code in self._watching:
+            if code not in wanted:
+                mon.set_local_events(tool_id, code, 0)
+
+        for code, events in wanted.items():
+            mon.set_local_events(tool_id, code, events)
+
+        mon.set_events(tool_id, global_events)
+        self._watching = watching
+
+        # re-enables any lines which were disabled
+        mon.restart_events()
+
+
+    def _callbacks(self):
+        events = _monitoring.events
+        return ((events.LINE, self._line),
+                (events.PY_YIELD, self._yield),
+                (events.PY_RETURN, self._return),
+                (events.PY_UNWIND, self._unwind))
+
+
+    def _install(self):
+        mon = _monitoring
+        tool_id = self._tool_id = _use_tool_id("livelocals")
+
+        for event, callback in self._callbacks():
+            mon.register_callback(tool_id, event, callback)
+
+
+    def _uninstall(self):
+        mon = _monitoring
+        tool_id = self._tool_id
+
+        for event, _callback in self._callbacks():
+            mon.register_callback(tool_id, event, None)
+
+        mon.free_tool_id(tool_id)
+        self._tool_id = None
+        self._watching = {}
+
+
+    def _line(self, code, line):
+        frame = sys._getframe(1)
+        disable = _monitoring.DISABLE
+        found = disable
+
+        # a line is only disabled once no tool wants it
+        for tool in self._watching.get(code, ()):
+            if tool._monitor_line(frame, code, line) is not disable:
+                found = None
+
+        return found
+
+
+    def _notify(self, handler, code, *args):
+        frame = sys._getframe(2)
+
+        for tool in self._watching.get(code, ()):
+            found = getattr(tool, handler, None)
+            if found is not None:
+                found(frame, code, *args)
+
+
+    def _yield(self, code, offset, value):
+        self._notify("_monitor_yield", code, offset, value)
+
+
+    def _return(self, code, offset, value):
+        self._notify("_monitor_return", code, offset, value)
+
+
+    def _unwind(self, code, offset, exc):
+        self._notify("_monitor_unwind", code, offset, exc)
+
+
+_monitor = _MonitorDispatcher() if _monitoring else None
+
+
+class LocalRewriter(object):
+    """
+    A set of rules which assign to local variables of specific code
+    objects, just before a given line of that code is executed.
+
+    The slot index and setter for each rule are resolved when the rule
+    is added, so applying a rule is a single native call. Only frames
+    running code which has rules will receive line events. Where
+    sys.monitoring is available, line events are enabled on only those
+    code objects, and lines without rules are disabled after they are
+    first seen. A single tool id is shared by all installed rewriters
+    and recorders, and it is never one of the ids which sys.monitoring
+    sets aside for debuggers, coverage tools, and profilers.
+
+    Otherwise, a sys.settrace hook is used which declines to trace
+    frames for code without rules. That hook is shared with any other
+    installed rewriters and recorders, and passes events on to
+    whatever trace function was already set, such as a debugger's.
+
+    Rules take effect once the rewriter is installed, either via the
+    `install()` method or as a context manager.
+    """
+
+    def __init__(self):
+        self._rules = {}
+        self._installed = False
+
+
+    def __enter__(self):
+        self.install()
+        return self
+
+
+    def __exit__(self, _tb_type, _tb_value, _tb_traceback):
+        self.uninstall()
+
+
+    def add(self, code, line, name, value=None, call=False):
+        """
+        Adds and returns a rule which assigns value to the variable
+        name when code reaches line. code may be a code object or a
+        function. If call is True, value is called with the frame, and
+        its result is assigned instead.
+
+        Raises a KeyError if code doesn't declare the variable.
+        """
+
+        code = _find_code(code)
+        index, _getter, setter, _deleter = _layout(code)[name]
+
+        rule = Rule(code, line, name, value, call)
+
+        lines = self._rules.get(code)
+        if lines is None:
+            lines = self._rules[code] = {}
+
+        lines.setdefault(line, []).append((index, setter, rule))
+
+        if self._installed and _monitoring:
+            _monitor.refresh()
+
+        return rule
+
+
+    def remove(self, rule):
+        """
+        Removes a rule which was previously added. Raises a ValueError
+        if the rule isn't present.
+        """
+
+        lines = self._rules.get(rule.code, {})
+        entries = lines.get(rule.line, ())
+
+        for entry in entries:
+            if entry[2] is rule:
+                entries.remove(entry)
+                break
+        else:
+            raise ValueError("%r is not present" % (rule, ))
+
+        if not entries:
+            del lines[rule.line]
+        if not lines:
+            del self._rules[rule.code]
+            if self._installed and _monitoring:
+                _monitor.refresh()
+
+
+    def rules(self):
+        """
+        List of the current rules, in the order they were added for
+        each line.
+        """
+
+        return [entry[2] for lines in self._rules.values()
+                for entries in lines.values()
+                for entry in entries]
+
+
+    def install(self):
+        """
+        Begins applying rules. Under sys.settrace this affects the
+        calling thread, any frames already running on its stack, and
+        threads started afterwards.
+        """
+
+        if self._installed:
+            return
+
+        if _monitoring:
+            self._monitor_install()
+        else:
+            self._trace_install()
+
+        self._installed = True
+
+
+    def uninstall(self):
+        """
+        Stops applying rules.
+        """
+
+        if not self._installed:
+            return
+
+        if _monitoring:
+            self._monitor_uninstall()
+        else:
+            self._trace_uninstall()
+
+        self._installed = False
+
+
+    def _apply(self, frame, entries):
+        for index, setter, rule in entries:
+            value = rule.value(frame) if rule.call else rule.value
+            setter(frame, index, value)
+
+
+    def _trace_install(self):
+        _dispatcher.add(self)
+
+        # frames which are already running won't see a call event
+        rules = self._rules
+        frame = sys._getframe(1)
+        while frame is not None:
+            if frame.f_code in rules:
+                _attach(frame, self._trace_line)
+            frame = frame.f_back
+
+
+    def _trace_uninstall(self):
+        _dispatcher.remove(self)
+
+
+    def _trace_call(self, frame, event, arg):
+        if frame.f_code in self._rules:
+            return self._trace_line
+        else:
+            return None
+
+
+    def _trace_line(self, frame, event, arg):
+        if not self._installed:
+            return None
+
+        if event == "line":
+            lines = self._rules.get(frame.f_code)
+            if lines:
+                entries = lines.get(frame.f_lineno)
+                if entries:
+                    self._apply(frame, entries)
+
+        return self._trace_line
+
+
+    def _monitor_install(self):
+        _monitor.add(self)
+
+
+    def _monitor_uninstall(self):
+        _monitor.remove(self)
+
+
+    def _monitor_events(self):
+        line = _monitoring.events.LINE
+        return dict((code, line) for code in self._rules), 0
+
+
+    def _monitor_line(self, frame, code, line):
+        lines = self._rules.get(code)
+        entries = lines.get(line) if lines else None
+
+        if not entries:
+            return _monitoring.DISABLE
+
+        self._apply(frame, entries)
+
+
+class LocalsRecorder(object):
+    """
+    Records the changes to the variables of every frame running a code
+    object, line by line, so that the variables of a frame may later be
+    rebuilt as they were at any recorded step.
+
+    At each line, and whenever the frame yields or returns, the frame's
+    variables are compared by identity against their previous values
+    in a single native call. Only the variables which were rebound or
+    cleared are recorded. Values are recorded by reference, so changes
+    made within a mutable value are not seen.
+
+    The entries are kept in a ring buffer of at most maxlen steps. As
+    the oldest entries are discarded, their changes are folded into a
+    base state for their frame, so that later steps of that frame can
+    still be rebuilt.
+
+    Like LocalRewriter, this uses sys.monitoring where available, and
+    otherwise a sys.settrace hook which only traces frames running the
+    recorded code. Either way, the tool id or hook is the same one
+    shared by any installed rewriters, so both see every line of the
+    frames they watch. Note that from Python 3.13, a generator which is
+    closed while paused at a yield outside of any try block ends
+    without running, and so without any event, and its frame is kept
+    until the recorder is uninstalled. It
+    takes effect once installed, either via the `install()` method or
+    as a context manager.
+    """
+
+    def __init__(self, code, maxlen=10000):
+        code = _find_code(code)
+
+        self.code = code
+        self.fields = code.co_varnames + code.co_cellvars + code.co_freevars
+        self.maxlen = maxlen
+
+        self._entries = deque()
+        self._steps = count()
+        self._calls = count()
+
+        # frame -> (call, previous values) for frames being recorded
+        self._frames = {}
+
+        # frames whose latest trace event was an exception
+        self._raising = set()
+
+        # call -> number of entries of that call in the buffer
+        self._pending = {}
+
+        # call -> values before the oldest entry of that call which is
+        # still in the buffer, if any of its entries were discarded
+        self._bases = {}
+
+        self._installed = False
+
+
+    def __enter__(self):
+        self.install()
+        return self
+
+
+    def __exit__(self, _tb_type, _tb_value, _tb_traceback):
+        self.uninstall()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def install(self):
+        """
+        Begins recording. Under sys.settrace this affects the calling
+        thread, any frames already running on its stack, and threads
+        started afterwards.
+        """
+
+        if self._installed:
+            return
+
+        if _monitoring:
+            self._monitor_install()
+        else:
+            self._trace_install()
+
+        self._installed = True
+
+
+    def uninstall(self):
+        """
+        Stops recording. The recorded entries are kept.
+        """
+
+        if not self._installed:
+            return
+
+        if _monitoring:
+            self._monitor_uninstall()
+        else:
+            self._trace_uninstall()
+
+        self._installed = False
+        self._frames.clear()
+        self._raising.clear()
+
+
+    def clear(self):
+        """
+        Discards all of the recorded entries.
+        """
+
+        self._entries.clear()
+        self._pending.clear()
+        self._bases.clear()
+
+
+    def steps(self):
+        """
+        List of (step, call, line) tuples for the recorded entries, from
+        oldest to newest. Each frame which ran the code is given its own
+        call number.
+        """
+
+        return [entry[:3] for entry in self._entries]
+
+
+    def changes(self, step):
+        """
+        Returns a dict of the variables which were assigned or cleared
+        by the given step. Cleared variables have the value UNBOUND.
+        Raises an IndexError if the step is not in the buffer.
+        """
+
+        fields = self.fields
+        entry = self._entry(step)
+        return dict((fields[index], value) for index, value in entry[3])
+
+
+    def locals_at(self, step):
+        """
+        Returns a dict of the variables which were bound in the frame of
+        the given step, as of that step. Raises an IndexError if the
+        step is not in the buffer.
+        """
+
+        entry = self._entry(step)
+        call = entry[1]
+
+        values = list(self._bases.get(call, ()))
+        if not values:
+            values = [UNBOUND] * len(self.fields)
+
+        entries = self._entries
+        for other in islice(entries, 0, step - entries[0][0] + 1):
+            if other[1] == call:
+                for index, value in other[3]:
+                    values[index] = value
+
+        return dict((name, value) for name, value in
+                    zip(self.fields, values) if value is not UNBOUND)
+
+
+    def _entry(self, step):
+        entries = self._entries
+        if entries:
+            position = step - entries[0][0]
+            if 0 <= position < len(entries):
+                return entries[position]
+
+        raise IndexError("step %r is not recorded" % (step, ))
+
+
+    def _record(self, frame, line):
+        state = self._frames.get(frame)
+        if state is None:
+            state = (next(self._calls), [UNBOUND] * len(self.fields))
+            self._frames[frame] = state
+
+        call, previous = state
+        changes = frame_diff(frame, previous, UNBOUND)
+        if not changes:
+            return
+
+        entries = self._entries
+        while len(entries) >= self.maxlen:
+            self._discard()
+
+        entries.append((next(self._steps), call, line, changes))
+        self._pending[call] = self._pending.get(call, 0) + 1
+
+
+    def _discard(self):
+        _step, call, _line, changes = self._entries.popleft()
+
+        base = self._bases.get(call)
+        if base is None:
+            base = self._bases[call] = [UNBOUND] * len(self.fields)
+        for index, value in changes:
+            base[index] = value
+
+        remaining = self._pending[call] - 1
+        if remaining:
+            self._pending[call] = remaining
+        else:
+            del self._pending[call]
+            if not self._running(call):
+                del self._bases[call]
+
+
+    def _running(self, call):
+        return any(state[0] == call for state in self._frames.values())
+
+
+    def _finish(self, frame):
+        self._raising.discard(frame)
+        state = self._frames.pop(frame, None)
+        if state is not None and state[0] not in self._pending:
+            self._bases.pop(state[0], None)
+
+
+    def _trace_install(self):
+        _dispatcher.add(self)
+
+        frame = sys._getframe(1)
+        while frame is not None:
+            if frame.f_code is self.code:
+                _attach(frame, self._trace_local)
+            frame = frame.f_back
+
+
+    def _trace_uninstall(self):
+        _dispatcher.remove(self)
+
+
+    def _trace_call(self, frame, event, arg):
+        if frame.f_code is self.code:
+            return self._trace_local
+        else:
+            return None
+
+
+    def _trace_local(self, frame, event, arg):
+        if not self._installed:
+            return None
+
+        if event == "line":
+            self._raising.discard(frame)
+            self._record(frame, frame.f_lineno)
+
+        elif event == "exception":
+            self._raising.add(frame)
+
+        elif event == "return":
+            self._record(frame, frame.f_lineno)
+
+            # an exception raised at a yield, such as by close() or
+            # throw(), which isn't caught leaves the frame looking as
+            # if it had yielded. A caught one is always followed by a
+            # line event before the frame can yield again.
+            raised = arg is None and frame in self._raising
+            if raised or not _suspended(frame):
+                self._finish(frame)
+            else:
+                self._raising.discard(frame)
+
+        return self._trace_local
+
+
+    def _monitor_install(self):
+        _monitor.add(self)
+
+
+    def _monitor_uninstall(self):
+        _monitor.remove(self)
+
+
+    def _monitor_events(self):
+        events = _monitoring.events
+        local_events = events.LINE | events.PY_YIELD | events.PY_RETURN
+
+        # unwinding can only be monitored globally
+        return {self.code: local_events}, events.PY_UNWIND
+
+
+    def _monitor_line(self, frame, code, line):
+        self._record(frame, line)
+
+
+    def _monitor_yield(self, frame, code, offset, value):
+        self._record(frame, frame.f_lineno)
+
+
+    def _monitor_return(self, frame, code, offset, value):
+        self._record(frame, frame.f_lineno)
+        self._finish(frame)
+
+
+    def _monitor_unwind(self, frame, code, offset, exc):
+        self._finish(frame)
+
+
+#
+# The end.
@@ -30,7 +30,7 @@ except ImportError:
 
 
 PYTHON_SUPPORTED_VERSIONS = (
-    ">=2.6",
+    ">=2.7",
     "!=3.0.*", "!=3.1.*", "!=3.2.*", "!=3.3.*",
     "<4",
 )
@@ -43,7 +43,6 @@ TROVE_CLASSIFIERS = (
     " :: GNU Lesser General Public License v3 or later (LGPLv3+)",
     "Operating System :: OS Independent",
     "Programming Language :: Python :: Implementation :: CPython",
-    "Programming Language :: Python :: 2.6",
     "Programming Language :: Python :: 2.7",
     "Programming Language :: Python :: 3.5",
     "Programming Language :: Python :: 3.6",
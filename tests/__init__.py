@@ -23,10 +23,34 @@ license: LGPL v.3
 """
 
 
-from livelocals import livelocals, localvar, getvar, setvar, delvar
-from unittest import TestCase
+from livelocals import livelocals, localvar, getvar, setvar, delvar, \
+    closurelocals, rebind_closures, \
+    LiveDictLocals, lookup_dynamic, evaluate, record_type, snapshot_record, \
+    LocalsRecord, UNBOUND, with_livelocals, snapshot, namespace, \
+    set_hooks, stats, reset_stats, \
+    _CodeCache, _ShardedCache
+from livelocals.liveness import liveness
+from livelocals.report import capture_traceback
+from livelocals.trace import LocalRewriter, LocalsRecorder, _thread_trace
+
+try:
+    from livelocals.shm import LocalsExporter, LocalsReader
+except ImportError:
+    LocalsExporter = None
+
+try:
+    import _xxsubinterpreters as _interpreters
+except ImportError:
+    _interpreters = None
+
+from inspect import currentframe
+from sys import version_info
+from unittest import TestCase, skipIf
 from weakref import WeakValueDictionary
 
+import sys
+import threading
+
 
 class TestLiveLocals(TestCase):
 
@@ -367,6 +391,29 @@ class TestLiveLocals(TestCase):
         self.assertEqual(len(cache), 0)
 
 
+    def test_sharded_cache(self):
+        cache = _ShardedCache(4)
+
+        def make_inner(value=None):
+            return livelocals(_cache=cache)
+
+        ll1 = make_inner(1)
+        ll2 = make_inner(2)
+        ll3 = livelocals(_cache=cache)
+
+        self.assertTrue(ll3 is livelocals(_cache=cache))
+        self.assertEqual(len(cache), 3)
+
+        ll1.clear()
+        del ll1
+        self.assertEqual(len(cache), 2)
+
+        # clearing ll3 also deletes it from this frame
+        ll3.clear()
+        del ll2
+        self.assertEqual(len(cache), 0)
+
+
     def test_with(self):
         cache = WeakValueDictionary()
 
@@ -391,6 +438,366 @@ class TestLiveLocals(TestCase):
         self.assertEqual(len(cache), 0)
 
 
+_MODULE_SOURCE = """
+from livelocals import livelocals
+
+a = 1
+ll = livelocals()
+ll["a"] = 2
+ll["b"] = 3
+seen = (a, b)
+del ll["b"]
+"""
+
+
+class TestDictLocals(TestCase):
+
+    def test_module_frame(self):
+        scope = {}
+        exec(compile(_MODULE_SOURCE, "<test>", "exec"), scope)
+
+        ll = scope["ll"]
+        self.assertTrue(isinstance(ll, LiveDictLocals))
+        self.assertEqual(scope["seen"], (2, 3))
+        self.assertFalse("b" in scope)
+        self.assertFalse("b" in ll)
+        self.assertRaises(KeyError, ll.__getitem__, "b")
+
+        # the view is over the module's dict, not a copy of it
+        scope["a"] = 10
+        self.assertEqual(ll["a"], 10)
+        self.assertEqual(ll.get("c", 4), 4)
+
+        ll.clear()
+        self.assertFalse("ll" in scope)
+
+
+    def test_class_body(self):
+
+        class Example(object):
+            x = 1
+            ll = livelocals()
+            ll["x"] = 2
+            ll["y"] = 3
+            ll.update({"x": 4, "w": 5})
+            names = sorted(k for k in ll.keys() if not k.startswith("__"))
+
+            has_class = "__class__" in ll
+            try:
+                ll["__class__"]
+            except NameError:
+                unbound = True
+            except KeyError:
+                unbound = False
+
+            found = getvar("y")
+            evaluate("z = x + y", writeback=True)
+
+            ll.clear()
+
+            def method(self):
+                return __class__
+
+        self.assertEqual(Example.x, 4)
+        self.assertEqual(Example.y, 3)
+        self.assertEqual(Example.z, 7)
+        self.assertEqual(Example.found, 3)
+        self.assertEqual(Example.names, ["ll", "x", "y"])
+        self.assertFalse(hasattr(Example, "w"))
+        self.assertFalse(hasattr(Example, "ll"))
+
+        # only Python 3 gives methods a __class__ cell
+        py3 = version_info >= (3, 0)
+        self.assertEqual(Example.has_class, py3)
+        self.assertEqual(Example.unbound, py3)
+
+
+class TestTransaction(TestCase):
+
+    def test_transaction(self):
+        a = 1
+        b = 2
+        c = 3
+
+        def closure():
+            return c
+
+        ll = livelocals()
+
+        with ll.transaction() as tx:
+            tx["a"] = 10
+            del tx["b"]
+            tx["c"] = 30
+
+            # nothing is applied until the block exits
+            self.assertEqual((a, b, closure()), (1, 2, 3))
+            self.assertEqual(tx["a"], 10)
+            self.assertRaises(NameError, tx.__getitem__, "b")
+            self.assertEqual(len(tx), 3)
+
+        self.assertEqual(len(tx), 0)
+        self.assertEqual((a, closure()), (10, 30))
+        self.assertRaises(NameError, getvar, "b")
+
+        del ll
+
+
+    def test_rollback(self):
+        a = 1
+        ll = livelocals()
+
+        def failing():
+            with ll.transaction() as tx:
+                tx["a"] = 2
+                self.assertRaises(KeyError, tx.__setitem__, "nope", 3)
+                raise ValueError()
+
+        self.assertRaises(ValueError, failing)
+        self.assertEqual(a, 1)
+
+
+    def test_generator(self):
+
+        def work():
+            first = 0
+            second = 0
+            while True:
+                yield first, second
+
+        gen = work()
+        next(gen)
+
+        with livelocals(gen.gi_frame).transaction() as tx:
+            tx["first"] = 1
+            tx["second"] = 2
+
+        self.assertEqual(next(gen), (1, 2))
+
+
+    def test_hooks(self):
+        left = 1
+        right = 1
+
+        seen = []
+
+        def callback(frame, name, old, new):
+            # every write is in place before any hook is called
+            seen.append((name, old, new, getvar("left", frame=frame),
+                         getvar("right", frame=frame)))
+
+        ll = livelocals()
+
+        reset_stats()
+        set_hooks(stats=True, callback=callback)
+        try:
+            with ll.transaction() as tx:
+                tx["left"] = 2
+                tx["right"] = 3
+        finally:
+            set_hooks()
+
+        self.assertEqual(sorted(seen), [("left", 1, 2, 2, 3),
+                                        ("right", 1, 3, 2, 3)])
+        self.assertEqual(stats()["frame_apply"], 1)
+        self.assertEqual(stats()["frame_set_fast"], 0)
+
+        del ll
+
+
+class TestWithLivelocals(TestCase):
+
+    def test_decorator(self):
+
+        @with_livelocals
+        def work(a, b=2, ll=None):
+            c = None
+            del c
+
+            ll["a"] = ll["b"] * 10
+            found = ("a" in ll, "nope" in ll, ll.get("c", "unset"))
+            self.assertRaises(NameError, ll.__getitem__, "c")
+            self.assertRaises(KeyError, ll.__getitem__, "nope")
+
+            def helper():
+                # binds to work's frame, even when first used here
+                return ll["b"]
+
+            return a, helper(), found, ll
+
+        a, b, found, handle = work(1)
+        self.assertEqual((a, b), (20, 2))
+        self.assertEqual(found, (True, False, "unset"))
+
+        # the frame is released when the call returns
+        self.assertTrue(handle._frame is None)
+        self.assertRaises(RuntimeError, handle.__getitem__, "a")
+        self.assertRaises(RuntimeError, getattr, handle, "frame")
+        self.assertEqual(work.__name__, "work")
+
+
+    def test_escaped(self):
+
+        @with_livelocals
+        def work(depth, ll=None):
+            if depth:
+                inner = work(depth - 1)
+
+                # the inner call's handle doesn't rebind to this frame,
+                # which is running the same code
+                self.assertRaises(RuntimeError, inner.__getitem__, "depth")
+                self.assertRaises(RuntimeError, inner.__setitem__,
+                                  "depth", 10)
+                self.assertRaises(RuntimeError, inner.get, "depth")
+                self.assertEqual(ll["depth"], depth)
+
+            return ll
+
+        work(1)
+
+
+    def test_recursive(self):
+
+        @with_livelocals
+        def work(depth, outer=None, ll=None):
+            if outer is not None:
+                # the first use of the outer call's handle is from
+                # this call, which is running the same code
+                outer["depth"] = 100
+                return depth
+
+            return work(depth - 1, ll), depth
+
+        self.assertEqual(work(3), (2, 100))
+
+
+    def test_name(self):
+
+        @with_livelocals(name="scope")
+        def work(value, scope):
+            scope["value"] = value + 1
+            return value
+
+        self.assertEqual(work(1), 2)
+
+        def missing(value):
+            return value
+
+        self.assertRaises(TypeError, with_livelocals, missing)
+
+
+    def test_generator(self):
+
+        @with_livelocals
+        def work(ll=None):
+            total = 0
+            while True:
+                yield total
+                total += 1
+
+        gen = work()
+        self.assertEqual(next(gen), 0)
+
+        handle = gen.gi_frame.f_locals["ll"]
+        handle["total"] = 10
+        self.assertEqual(next(gen), 11)
+
+
+class TestClosureLocals(TestCase):
+
+    def test_closurelocals(self):
+
+        def factory(limit):
+            client = "old"
+            if limit is None:
+                # never assigned, so this cell is left empty
+                unset = None
+
+            def handler(value):
+                if value is None:
+                    return unset
+                return (value < limit, client)
+
+            return handler
+
+        handler = factory(10)
+        cl = closurelocals(handler)
+
+        self.assertEqual(cl["limit"], 10)
+        self.assertEqual(dict(cl.items()), {"limit": 10, "client": "old"})
+        self.assertTrue("client" in cl)
+        self.assertFalse("value" in cl)
+        self.assertRaises(KeyError, cl.__getitem__, "value")
+        self.assertRaises(NameError, cl.__getitem__, "unset")
+        self.assertEqual(cl.get("unset", "nope"), "nope")
+
+        cl["limit"] = 5
+        cl["client"] = "new"
+        self.assertEqual(handler(7), (False, "new"))
+
+        del cl["client"]
+        self.assertRaises(NameError, handler, 1)
+        self.assertEqual(cl.setdefault("client", "default"), "default")
+        self.assertEqual(handler(1), (True, "default"))
+
+        self.assertRaises(TypeError, getattr, cl, "ns")
+        self.assertRaises(TypeError, cl.transaction)
+        self.assertRaises(TypeError, closurelocals, len)
+
+        cl.clear()
+        self.assertFalse("limit" in cl)
+
+
+    def test_rebind(self):
+
+        def factory(limit):
+            def handler(value):
+                return value < limit
+            return handler
+
+        def other(limit, client):
+            def handler():
+                return client, limit
+            return handler
+
+        handlers = [factory(n) for n in range(100)]
+        mixed = handlers + [other(0, "old")]
+
+        self.assertEqual(rebind_closures(mixed, "limit", 50), 101)
+        self.assertEqual(sum(h(25) for h in handlers), 100)
+        self.assertEqual(mixed[-1](), ("old", 50))
+
+        # nothing changes unless every function has the variable
+        self.assertRaises(KeyError, rebind_closures, mixed, "client", 0)
+        self.assertRaises(TypeError, rebind_closures, handlers + [len],
+                          "limit", 0)
+        self.assertEqual(closurelocals(handlers[0])["limit"], 50)
+        self.assertEqual(rebind_closures(iter([]), "limit", 0), 0)
+
+
+    def test_rebind_release(self):
+
+        funcs = []
+
+        class Clearing(object):
+            def __del__(self):
+                # runs as the old values are released
+                del funcs[:]
+
+        def factory():
+            v = Clearing()
+
+            def handler():
+                return v
+            return handler
+
+        funcs.extend(factory() for _i in range(10))
+        handlers = list(funcs)
+
+        self.assertEqual(rebind_closures(funcs, "v", 1), 10)
+        self.assertEqual(funcs, [])
+        self.assertEqual([h() for h in handlers], [1] * 10)
+
+
 class TestLocalVar(TestCase):
 
     def test_localvar(self):
@@ -473,5 +880,991 @@ class TestLocalVar(TestCase):
         self.assertRaises(NameError, getvar, "cheddar")
 
 
+    def test_lookup_dynamic(self):
+
+        def inner():
+            ctx = None
+            del ctx
+            return lookup_dynamic("ctx")
+
+        def middle(depth=None):
+            return lookup_dynamic("ctx", max_depth=depth,
+                                  default="missing")
+
+        def outer():
+            ctx = "outer"
+            return inner(), middle(), middle(1)
+
+        # inner declares ctx but has it unbound, so outer's is found
+        self.assertEqual(outer(), ("outer", "outer", "missing"))
+
+        self.assertRaises(NameError, lookup_dynamic, "ctx")
+
+        def deeper():
+            ctx = "deeper"
+            return outer()
+
+        self.assertEqual(deeper(), ("outer", "outer", "missing"))
+
+
+class TestEvaluate(TestCase):
+
+    def test_evaluate(self):
+        a = 100
+        b = 200
+
+        self.assertEqual(evaluate("a + b"), 300)
+        self.assertEqual(evaluate("len([a, b])"), 2)
+
+        b = 300
+        self.assertEqual(evaluate("a + b"), 400)
+
+        del a
+        self.assertRaises(NameError, evaluate, "a + b")
+
+
+    def test_evaluate_closure(self):
+
+        def make_closure(value=None):
+            def getter():
+                return value
+            return getter, livelocals()
+
+        getter, ll = make_closure(100)
+        frame = ll.localvar("value").frame
+
+        self.assertEqual(evaluate("value * 2", frame), 200)
+
+        del ll
+
+
+    def test_evaluate_writeback(self):
+        a = 100
+        b = 200
+        c = 300
+
+        self.assertEqual(evaluate("a = b + c"), None)
+        self.assertEqual(a, 100)
+
+        evaluate("a = b + c", writeback=True)
+        self.assertEqual(a, 500)
+        self.assertEqual(b, 200)
+
+        evaluate("del c; z = 1", writeback=True)
+        self.assertRaises(NameError, getvar, "c")
+        self.assertRaises(NameError, getvar, "z")
+
+
+    def test_evaluate_cache(self):
+        cache = _CodeCache(2)
+        a = 1
+
+        self.assertEqual(evaluate("a + 1", _codes=cache), 2)
+        self.assertEqual(evaluate("a + 2", _codes=cache), 3)
+        self.assertEqual(len(cache), 2)
+
+        # touching the first entry makes the second the eldest
+        self.assertEqual(evaluate("a + 1", _codes=cache), 2)
+        self.assertEqual(evaluate("a + 3", _codes=cache), 4)
+
+        self.assertEqual(len(cache), 2)
+        self.assertTrue("a + 1" in cache)
+        self.assertFalse("a + 2" in cache)
+
+        self.assertRaises(SyntaxError, evaluate, "a +", _codes=cache)
+        self.assertEqual(len(cache), 2)
+
+
+    def test_evaluate_cache_threads(self):
+        cache = _CodeCache(2)
+        sources = ["1 + %i" % i for i in range(3)]
+        errors = []
+
+        def work():
+            try:
+                for _i in range(2000):
+                    for source in sources:
+                        cache.get(source)
+            except Exception as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=work) for _i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(cache), 2)
+
+
+class TestLocalRewriter(TestCase):
+
+    def test_rewrite_fast(self):
+
+        def work(a=1):
+            b = a + 1
+            c = b + 1
+            return a, b, c
+
+        rewriter = LocalRewriter()
+        rule = rewriter.add(work, work.__code__.co_firstlineno + 2, "b", 10)
+
+        self.assertEqual(rewriter.rules(), [rule])
+        self.assertEqual(work(), (1, 2, 3))
+
+        with rewriter:
+            self.assertEqual(work(), (1, 10, 11))
+            self.assertEqual(work(5), (5, 10, 11))
+
+        self.assertEqual(work(), (1, 2, 3))
+
+        rewriter.remove(rule)
+        self.assertEqual(rewriter.rules(), [])
+        self.assertRaises(ValueError, rewriter.remove, rule)
+
+        with rewriter:
+            self.assertEqual(work(), (1, 2, 3))
+
+
+    def test_rewrite_cell(self):
+
+        def work(a=1):
+            def getter():
+                return a
+            b = getter()
+            return b
+
+        line = work.__code__.co_firstlineno + 3
+
+        rewriter = LocalRewriter()
+        rewriter.add(work, line, "a", lambda frame: 100, call=True)
+
+        with rewriter:
+            self.assertEqual(work(), 100)
+
+        self.assertEqual(work(), 1)
+
+
+    def test_rewrite_call(self):
+
+        def work(a):
+            b = a
+            return b
+
+        seen = []
+
+        def replace(frame):
+            seen.append(frame.f_code)
+            return 2 * getvar("a", frame=frame)
+
+        rewriter = LocalRewriter()
+        rewriter.add(work.__code__, work.__code__.co_firstlineno + 2,
+                     "b", replace, call=True)
+
+        with rewriter:
+            self.assertEqual(work(3), 6)
+            self.assertEqual(work(4), 8)
+
+        self.assertEqual(seen, [work.__code__] * 2)
+
+
+    def test_running_frame(self):
+        value = 1
+
+        code = currentframe().f_code
+        line = code.co_firstlineno + 10
+
+        rewriter = LocalRewriter()
+        rewriter.add(code, line, "value", 2)
+
+        with rewriter:
+            self.assertEqual(value, 2)
+
+        self.assertEqual(value, 2)
+
+
+    def test_previous_tracer(self):
+
+        def work(a=1):
+            b = a + 1
+            return b
+
+        def other():
+            return 1
+
+        seen = []
+
+        def tracer(frame, event, arg):
+            if frame.f_code in (work.__code__, other.__code__):
+                seen.append((frame.f_code.co_name, event))
+            return tracer
+
+        rewriter = LocalRewriter()
+        rewriter.add(work, work.__code__.co_firstlineno + 2, "b", 10)
+
+        original = sys.gettrace()
+        sys.settrace(tracer)
+        threading.settrace(tracer)
+        try:
+            with rewriter:
+                self.assertEqual(work(), 10)
+                other()
+
+            self.assertTrue(sys.gettrace() is tracer)
+            self.assertTrue(_thread_trace() is tracer)
+
+        finally:
+            threading.settrace(None)
+            sys.settrace(original)
+
+        # the tracer which was already set kept seeing every event
+        self.assertTrue(("work", "line") in seen)
+        self.assertTrue(("work", "return") in seen)
+        self.assertTrue(("other", "call") in seen)
+
+
+    def test_foreign_tracer(self):
+
+        def work():
+            value = 1
+            return value
+
+        line = work.__code__.co_firstlineno + 2
+
+        def foreign(frame, event, arg):
+            return None
+
+        rewriter = LocalRewriter()
+        rewriter.add(work, line, "value", 99)
+
+        original = sys.gettrace()
+        try:
+            with rewriter:
+                # another tool sets and clears its own tracer, which
+                # removes the rewriter's hook
+                sys.settrace(foreign)
+                sys.settrace(None)
+
+            # installing again sets the hook again
+            with rewriter:
+                self.assertEqual(work(), 99)
+
+            fresh = LocalRewriter()
+            fresh.add(work, line, "value", 7)
+            with fresh:
+                self.assertEqual(work(), 7)
+
+            self.assertTrue(sys.gettrace() is None)
+
+        finally:
+            sys.settrace(original)
+
+
+    def test_undeclared(self):
+
+        def work():
+            return 1
+
+        rewriter = LocalRewriter()
+        self.assertRaises(KeyError, rewriter.add, work, 1, "zzz", None)
+
+
+def needs_liveness(fn):
+    return skipIf(liveness(needs_liveness.__code__) is None,
+                  "bytecode analysis unavailable")(fn)
+
+
+class TestLocalsRecorder(TestCase):
+
+    def test_record(self):
+
+        def work(count):
+            total = 0
+            for i in range(count):
+                total += i
+            return total
+
+        first = work.__code__.co_firstlineno
+
+        with LocalsRecorder(work) as rec:
+            work(3)
+            work(0)
+
+        steps = rec.steps()
+        calls = [call for _step, call, _line in steps]
+        self.assertEqual(sorted(set(calls)), [0, 1])
+
+        step, call, line = steps[0]
+        self.assertEqual((call, line), (0, first + 1))
+        self.assertEqual(rec.changes(step), {"count": 3})
+
+        last = [s for s in steps if s[1] == 0][-1][0]
+        self.assertEqual(rec.locals_at(last),
+                         {"count": 3, "total": 3, "i": 2})
+
+        # only what changed is kept in each entry
+        self.assertTrue(all(len(rec.changes(s[0])) == 1 for s in steps))
+
+        self.assertEqual(rec.locals_at(steps[-1][0]),
+                         {"count": 0, "total": 0})
+
+        self.assertRaises(IndexError, rec.locals_at, steps[-1][0] + 1)
+
+
+    def test_bounded(self):
+
+        def work(count):
+            total = 0
+            for i in range(count):
+                total += i
+            return total
+
+        rec = LocalsRecorder(work, maxlen=3)
+        with rec:
+            work(10)
+
+        self.assertEqual(len(rec), 3)
+
+        # the earliest steps were discarded, but the locals can still
+        # be rebuilt from those which remain
+        steps = rec.steps()
+        self.assertRaises(IndexError, rec.changes, steps[0][0] - 1)
+        self.assertEqual(rec.locals_at(steps[-1][0]),
+                         {"count": 10, "total": 45, "i": 9})
+        self.assertEqual(rec.locals_at(steps[0][0])["count"], 10)
+
+        rec.clear()
+        self.assertEqual(len(rec), 0)
+
+
+    def test_generator(self):
+
+        def work():
+            value = 0
+            while True:
+                sent = yield value
+                value += sent
+
+        with LocalsRecorder(work) as rec:
+            gen = work()
+            next(gen)
+            gen.send(2)
+            gen.send(3)
+            gen.close()
+
+        steps = rec.steps()
+
+        # every resumption of the generator is the same call
+        self.assertEqual(set(call for _step, call, _line in steps), set([0]))
+        self.assertEqual(rec.locals_at(steps[-1][0]),
+                         {"value": 5, "sent": 3})
+
+
+    def test_generator_ended(self):
+
+        def work():
+            value = 0
+            while True:
+                value += yield value
+
+        def guarded():
+            while True:
+                try:
+                    yield None
+                except KeyError:
+                    pass
+
+        with LocalsRecorder(work) as rec:
+            for _i in range(5):
+                gen = work()
+                next(gen)
+                gen.close()
+
+                gen = work()
+                next(gen)
+                self.assertRaises(ValueError, gen.throw, ValueError)
+
+            # each frame was finished, rather than kept as suspended
+            self.assertEqual(rec._frames, {})
+
+        with LocalsRecorder(guarded) as rec:
+            gen = guarded()
+            next(gen)
+
+            # caught, so the generator is suspended again
+            gen.throw(KeyError)
+            self.assertEqual(len(rec._frames), 1)
+
+            gen.close()
+            self.assertEqual(rec._frames, {})
+
+
+    def test_with_rewriter(self):
+
+        def work():
+            value = 2
+            return value
+
+        rewriter = LocalRewriter()
+        rewriter.add(work, work.__code__.co_firstlineno + 2, "value", 99)
+
+        rec = LocalsRecorder(work)
+
+        with rewriter:
+            with rec:
+                self.assertEqual(work(), 99)
+
+            self.assertEqual(work(), 99)
+
+            # uninstalled out of order
+            rec.install()
+            rewriter.uninstall()
+            self.assertEqual(work(), 2)
+            rec.uninstall()
+
+        self.assertEqual(work(), 2)
+
+        found = [rec.changes(step) for step, _call, _line in rec.steps()]
+        self.assertTrue({"value": 99} in found)
+        self.assertTrue({"value": 2} in found)
+
+
+class TestSnapshot(TestCase):
+
+    def test_snapshot_all(self):
+        a = 100
+        b = 200
+        c = 300
+        del c
+
+        self.assertEqual(snapshot(live_only=False),
+                         {"a": 100, "b": 200, "self": self})
+
+
+    @needs_liveness
+    def test_snapshot_live(self):
+
+        def work():
+            big = [0] * 100
+            small = len(big)
+            yield snapshot()
+            yield small
+            total = small
+            yield snapshot()
+            yield total
+
+        gen = work()
+        self.assertEqual(next(gen), {"small": 100})
+        self.assertEqual(next(gen), 100)
+        self.assertEqual(next(gen), {"total": 100})
+
+        full = snapshot(gen.gi_frame, live_only=False)
+        self.assertEqual(sorted(full), ["big", "small", "total"])
+
+        # the generator hasn't started yet, so nothing is live
+        self.assertEqual(snapshot(work().gi_frame), {})
+
+
+    @needs_liveness
+    def test_snapshot_handler(self):
+
+        def work():
+            value = 1
+            try:
+                other = 2
+                yield snapshot()
+                raise ValueError()
+            except ValueError:
+                yield value
+
+        gen = work()
+        self.assertEqual(next(gen), {"value": 1})
+
+
+    @needs_liveness
+    def test_snapshot_loop(self):
+
+        def work(count):
+            total = 0
+            for i in range(count):
+                yield snapshot()
+                total += i
+            yield total
+
+        # count is only read to build the range, before the loop
+        gen = work(2)
+        self.assertEqual(next(gen), {"total": 0, "i": 0})
+
+
+    @needs_liveness
+    def test_snapshot_cells(self):
+
+        def work():
+            cell = 1
+            fast = 2
+
+            def getter():
+                return cell
+
+            return snapshot()
+
+        self.assertEqual(work(), {"cell": 1})
+
+
+class TestRecord(TestCase):
+
+    def test_record(self):
+        outer = "cell"
+
+        def work(a, b=2):
+            c = a + b
+            d = None
+            del d
+            return snapshot_record(), outer
+
+        rec, _outer = work(1)
+
+        self.assertTrue(isinstance(rec, LocalsRecord))
+        self.assertTrue(type(rec) is record_type(work.__code__))
+        self.assertEqual(rec._fields, ("a", "b", "c", "d", "outer"))
+        self.assertEqual(tuple(rec), (1, 2, 3, UNBOUND, "cell"))
+        self.assertEqual((rec.a, rec.c, rec.outer), (1, 3, "cell"))
+        self.assertTrue(rec.d is UNBOUND)
+        self.assertEqual(rec._asdict(),
+                         {"a": 1, "b": 2, "c": 3, "outer": "cell"})
+        self.assertEqual(repr(rec),
+                         "work(a=1, b=2, c=3, d=<unbound>, outer='cell')")
+
+        self.assertRaises(AttributeError, setattr, rec, "a", 5)
+        self.assertRaises(AttributeError, setattr, rec, "other", 5)
+
+
+    def test_record_cell_arg(self):
+
+        def work(value):
+            def inner():
+                return value
+            return snapshot_record()
+
+        rec = work(5)
+        self.assertEqual(rec.value, 5)
+        self.assertEqual(rec._asdict()["value"], 5)
+
+
+    def test_record_pickle(self):
+        from pickle import dumps, loads
+
+        def work():
+            x = 1
+            y = [2]
+            z = None
+            del z
+            return snapshot_record()
+
+        rec = work()
+        for protocol in (0, 2):
+            found = loads(dumps(rec, protocol))
+            self.assertTrue(type(found) is type(rec))
+            self.assertEqual(found, rec)
+            self.assertTrue(found.z is UNBOUND)
+
+
+class TestNamespace(TestCase):
+
+    def test_namespace_fast(self):
+        a = 100
+        b = 200
+
+        ns = namespace()
+
+        self.assertEqual(ns.a, 100)
+        ns.a += ns.b
+        self.assertEqual(a, 300)
+
+        b = 1
+        self.assertEqual(ns.b, 1)
+
+        del ns.b
+        self.assertRaises(NameError, getattr, ns, "b")
+        self.assertRaises(NameError, getvar, "b")
+
+        self.assertRaises(AttributeError, getattr, ns, "zzz")
+        self.assertRaises(AttributeError, setattr, ns, "zzz", 1)
+
+        del ns
+
+
+    def test_namespace_cell(self):
+
+        def make_closure(value=None):
+            def getter():
+                return value
+            return getter, namespace()
+
+        getter, ns = make_closure(100)
+
+        self.assertEqual(ns.value, 100)
+        ns.value = 200
+        self.assertEqual(getter(), 200)
+
+        del ns.value
+        self.assertRaises(NameError, getter)
+
+
+    def test_namespace_type(self):
+
+        def work():
+            x = 1
+            return namespace()
+
+        ns1 = work()
+        ns2 = work()
+
+        self.assertFalse(ns1 is ns2)
+        self.assertTrue(type(ns1) is type(ns2))
+        self.assertFalse(ns1.__frame__ is ns2.__frame__)
+        self.assertEqual(type(ns1).x.index, 0)
+
+
+    def test_livelocals_ns(self):
+        cache = WeakValueDictionary()
+        a = 100
+
+        with livelocals(_cache=cache) as ll:
+            refs = [ll]
+            ns = ll.ns
+            self.assertTrue(ns is ll.ns)
+
+            ns.a = 200
+            self.assertEqual(a, 200)
+            self.assertEqual(ll["a"], 200)
+
+        # clearing the livelocals also clears the frame's reference
+        # to the namespace
+        self.assertRaises(NameError, getvar, "ns")
+        self.assertRaises(ValueError, getattr, refs[0], "ns")
+
+
+class TestCaptureTraceback(TestCase):
+
+    def _raise(self):
+
+        def inner(data):
+            big = "x" * 10000
+            count = len(data)
+            missing = None
+            del missing
+            raise ValueError(count)
+
+        def outer():
+            data = list(range(1000))
+            inner(data)
+
+        try:
+            outer()
+        except ValueError:
+            import sys
+            return sys.exc_info()[2]
+
+
+    def test_capture(self):
+        tb = self._raise()
+        found = capture_traceback(tb, max_repr_len=40)
+
+        self.assertEqual([f.name for f in found],
+                         ["_raise", "outer", "inner"])
+
+        inner = found[-1]
+        self.assertEqual(sorted(inner.locals), ["big", "count", "data"])
+        self.assertEqual(inner.locals["count"], "1000")
+        self.assertTrue(len(inner.locals["big"]) <= 40)
+        self.assertTrue(len(inner.locals["data"]) <= 40)
+        self.assertFalse(inner.truncated)
+
+
+    def test_budgets(self):
+        tb = self._raise()
+
+        found = capture_traceback(tb, max_frames=2)
+        self.assertEqual([f.name for f in found], ["outer", "inner"])
+
+        found = capture_traceback(tb, max_vars=1)
+        self.assertEqual(len(found[-1].locals), 1)
+        self.assertTrue(found[-1].truncated)
+
+        # the innermost frame is captured first, and the budget runs
+        # out before the outer frames are reached
+        found = capture_traceback(tb, max_repr_len=20, max_total_bytes=60)
+        self.assertTrue(found[-1].locals)
+        self.assertEqual(found[0].locals, {})
+        self.assertTrue(found[0].truncated)
+
+        total = sum(len(k) + len(v) for f in found
+                    for k, v in f.locals.items())
+        self.assertTrue(total <= 60)
+
+
+    def test_unlimited(self):
+        tb = self._raise()
+
+        found = capture_traceback(tb, max_frames=None, max_vars=None,
+                                  max_repr_len=None, max_total_bytes=None)
+        self.assertEqual([f.name for f in found],
+                         ["_raise", "outer", "inner"])
+
+        inner = found[-1]
+        self.assertEqual(inner.locals["big"], repr("x" * 10000))
+        self.assertFalse(inner.truncated)
+
+
+    @skipIf(version_info < (3, 4), "traceback.clear_frames needs 3.4")
+    def test_cleared(self):
+        from traceback import clear_frames
+
+        def inner():
+            shared = "cell"
+            raise ValueError(lambda: shared)
+
+        try:
+            inner()
+        except ValueError:
+            tb = sys.exc_info()[2]
+
+        # a cleared frame has no cells left at all
+        clear_frames(tb)
+
+        found = capture_traceback(tb)
+        self.assertEqual(found[-1].name, "inner")
+        self.assertEqual(found[-1].locals, {})
+
+        ll = livelocals(tb.tb_next.tb_frame)
+        self.assertRaises(NameError, ll.__getitem__, "shared")
+        self.assertRaises(ValueError, ll.__setitem__, "shared", 1)
+
+
+@skipIf(LocalsExporter is None, "multiprocessing.shared_memory unavailable")
+class TestSharedExport(TestCase):
+
+    def test_export(self):
+        count = 1
+        ratio = 0.5
+        flag = True
+        empty = None
+        text = "x" * 1000
+        big = 1 << 80
+        gone = 0
+        del gone
+
+        names = ("count", "ratio", "flag", "empty", "text", "big", "gone")
+
+        with LocalsExporter(currentframe(), names, repr_size=32) as export:
+            with LocalsReader(export.name, untrack=False) as reader:
+                self.assertEqual(reader.names, names)
+                self.assertEqual(reader.version, 0)
+
+                export.update()
+                version, found = reader.read()
+
+                self.assertEqual(version, 2)
+
+                # long reprs are abbreviated, reprlib style
+                abbrev = found.pop("text")
+                self.assertTrue(len(abbrev) <= 32)
+                self.assertTrue("..." in abbrev)
+
+                self.assertEqual(found, {
+                    "count": 1, "ratio": 0.5, "flag": True,
+                    "empty": None, "big": repr(big),
+                })
+
+                count = 2
+                gone = "here"
+                del text
+
+                export.update()
+                version, found = reader.read()
+
+                self.assertEqual(version, 4)
+                self.assertEqual(found["count"], 2)
+                self.assertEqual(found["gone"], "'here'")
+                self.assertFalse("text" in found)
+
+
+    def test_export_thread(self):
+        count = 1
+
+        with LocalsExporter(currentframe(), ("count", )) as export:
+            with LocalsReader(export.name, untrack=False) as reader:
+                export.start(0.001)
+                while reader.version < 2:
+                    pass
+                export.stop()
+
+                self.assertEqual(reader.read()[1], {"count": 1})
+
+
+    def test_export_undeclared(self):
+        self.assertRaises(KeyError, LocalsExporter,
+                          currentframe(), ("zzz", ))
+
+
+class TestHooks(TestCase):
+
+    def tearDown(self):
+        set_hooks()
+        reset_stats()
+
+
+    def test_stats(self):
+        a = 100
+        var = localvar("a")
+
+        reset_stats()
+        var.getvar()
+        self.assertEqual(stats()["frame_get_fast"], 0)
+
+        set_hooks(stats=True)
+        var.getvar()
+        var.getvar()
+        var.setvar(200)
+        var.delvar()
+        self.assertRaises(NameError, var.getvar)
+
+        found = stats()
+        self.assertEqual(found["frame_get_fast"], 3)
+        self.assertEqual(found["frame_set_fast"], 1)
+        self.assertEqual(found["frame_del_fast"], 1)
+        self.assertEqual(found["name_error"], 1)
+        self.assertEqual(found["range_error"], 0)
+
+        reset_stats()
+        self.assertEqual(set(stats().values()), set([0]))
+
+        del var
+
+
+    def test_callback(self):
+        seen = []
+
+        def hook(frame, name, old, new):
+            seen.append((frame, name, old, new))
+
+        def make_closure(value=None):
+            def getter():
+                return value
+            return getter, livelocals()
+
+        getter, ll = make_closure(1)
+        frame = ll.localvar("value").frame
+
+        set_hooks(callback=hook)
+        ll["value"] = 2
+        del ll["value"]
+        set_hooks()
+        ll["value"] = 3
+
+        self.assertEqual(seen, [(frame, "value", 1, 2),
+                                (frame, "value", 2, None)])
+
+        def failing(frame, name, old, new):
+            raise ValueError(name)
+
+        set_hooks(callback=failing)
+        self.assertRaises(ValueError, ll.__setitem__, "value", 4)
+
+        # the write itself was still applied
+        set_hooks()
+        self.assertEqual(getter(), 4)
+
+        del ll
+
+
+    @skipIf(version_info < (3, 8), "audit hooks require Python 3.8")
+    def test_audit(self):
+        import sys
+
+        seen = []
+        active = [True]
+
+        def hook(event, args):
+            if active[0] and event == "livelocals.write":
+                seen.append(args[1:])
+
+        sys.addaudithook(hook)
+
+        try:
+            a = 1
+            set_hooks(audit=True)
+            setvar("a", 2)
+            set_hooks()
+            setvar("a", 3)
+        finally:
+            active[0] = False
+
+        self.assertEqual(seen, [("a", 1, 2)])
+
+
+_SUBINTERPRETER_SCRIPT = """
+import sys
+sys.path.insert(0, %r)
+
+from livelocals import livelocals, namespace, set_hooks, stats
+
+def check():
+    value = 1
+    ll = livelocals()
+    set_hooks(stats=True)
+    for _i in range(%d):
+        ll["value"] = ll["value"] + 1
+    namespace().value += 1
+    set_hooks()
+    assert value == %d + 2, value
+    assert stats()["frame_set_fast"] == %d, stats()
+    assert stats()["slotvar_set"] == 1, stats()
+
+check()
+"""
+
+
+class TestSubinterpreters(TestCase):
+
+    @skipIf(_interpreters is None, "subinterpreters not available")
+    def test_isolated_state(self):
+        from os.path import dirname
+        from threading import Thread
+
+        reset_stats()
+        count = 50
+        script = _SUBINTERPRETER_SCRIPT % (dirname(dirname(__file__)),
+                                           count, count, count)
+
+        errors = []
+
+        def run():
+            # an interpreter which imported threading must be destroyed
+            # from the thread which ran it
+            interp = _interpreters.create()
+            try:
+                _interpreters.run_string(interp, script)
+            except Exception as err:
+                errors.append(err)
+            finally:
+                _interpreters.destroy(interp)
+
+        threads = [Thread(target=run) for _i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+
+        # each interpreter counted only its own writes, in its own
+        # module state, leaving this interpreter's counters alone
+        self.assertEqual(stats()["frame_set_fast"], 0)
+        self.assertEqual(stats()["slotvar_set"], 0)
+
+
 #
 # The end.